@@ -0,0 +1,389 @@
+# load_bench.py
+"""
+Нагрузочный стенд: настоящий Dispatcher и роутеры из main.py против фейкового Bot API.
+
+Bot API поднимается локально (aiohttp), записывает каждый вызов и отвечает
+с заданной задержкой. База — из .env, как у бота: направьте её на тестовую.
+Сценарии:
+
+    join      — наплыв входов в группу (chat_member)
+    flood     — неверифицированные пишут в группу при включённом /reg_mode
+    admin     — пачка админских команд /mute, /unmute, /up со списком @username
+    register  — параллельные регистрации в личке, от /start до стипендии
+
+Пример:
+
+    python bench/load_bench.py --users 500 --concurrency 64 --api-latency 40
+
+Пишет в users строки с telegram_id от BENCH_ID_BASE и удаляет их в конце,
+вместе с admin_action_logs и pending_deletions тестового чата.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+import config
+import db
+import deletions
+import main
+import metrics
+import outbound
+import sharding
+from fsm_storage import PostgresStorage
+from handlers import admin_logger, group, reg_mode, roster
+from usernames import resolver
+
+BENCH_ID_BASE = 7_000_000_000_000
+BENCH_CHAT_ID = -1009000000001
+
+
+# ====================== Фейковый Bot API ======================
+class FakeBotApi:
+    """Отвечает на /bot<token>/<method>, считает вызовы и держит паузу latency ± jitter"""
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await request.post()
+        if self.latency:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        return web.json_response({"ok": True, "result": self._result(method.lower(), params)})
+
+    def _result(self, method: str, params) -> Any:
+        if method == "getme":
+            return {"id": _bot_id(), "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("sendmessage", "editmessagetext"):
+            chat_id = int(params.get("chat_id", 0))
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+def _bot_id() -> int:
+    return int(config.BOT_TOKEN.split(":")[0])
+
+
+# ====================== Генератор апдейтов ======================
+class UpdateFactory:
+    """Синтетические апдейты в формате Bot API (dict), как их присылает Telegram"""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(n: int) -> dict:
+        return {"id": BENCH_ID_BASE + n, "is_bot": False, "first_name": f"Bench{n}", "username": f"bench_u{n}"}
+
+    @staticmethod
+    def admin() -> dict:
+        return {"id": config.SUPER_ADMIN_ID, "is_bot": False, "first_name": "Admin", "username": "bench_admin"}
+
+    def _update(self, **payload) -> dict:
+        return {"update_id": next(self._update_ids), **payload}
+
+    def message(self, from_user: dict, text: str, chat: dict | None = None, reply_to: dict | None = None) -> dict:
+        chat = chat or {"id": from_user["id"], "type": "private", "first_name": from_user["first_name"]}
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+            "from": from_user,
+            "text": text,
+        }
+        if reply_to:
+            msg["reply_to_message"] = reply_to
+        return self._update(message=msg)
+
+    def group_message(self, from_user: dict, text: str) -> dict:
+        return self.message(from_user, text, {"id": BENCH_CHAT_ID, "type": "supergroup", "title": "Bench"})
+
+    def join(self, user: dict) -> dict:
+        now = int(time.time())
+        return self._update(chat_member={
+            "chat": {"id": BENCH_CHAT_ID, "type": "supergroup", "title": "Bench"},
+            "from": user,
+            "date": now,
+            "old_chat_member": {"status": "left", "user": user},
+            "new_chat_member": {"status": "member", "user": user},
+        })
+
+
+# Каждый поток — список апдейтов одного пользователя, внутри потока порядок сохраняется
+def scenario_join(f: UpdateFactory, users: int) -> list[list[dict]]:
+    return [[f.join(f.user(n))] for n in range(users)]
+
+
+def scenario_flood(f: UpdateFactory, users: int, messages: int) -> list[list[dict]]:
+    return [
+        [f.group_message(f.user(n), f"сообщение {i}") for i in range(messages)]
+        for n in range(users)
+    ]
+
+
+def scenario_admin(f: UpdateFactory, users: int, batch: int) -> list[list[dict]]:
+    streams = []
+    commands = itertools.cycle(("/mute", "/unmute", "/mute", "/up"))
+    for start in range(0, users, batch):
+        names = " ".join(f"@bench_u{n}" for n in range(start, min(start + batch, users)))
+        streams.append([f.group_message(f.admin(), f"{next(commands)} {names}")])
+    return streams
+
+
+def scenario_register(f: UpdateFactory, users: int) -> list[list[dict]]:
+    streams = []
+    for n in range(users):
+        u = f.user(n)
+        steps = ["/start", "/reg", "Бенчев Бенч Бенчевич", "123456", "ФКСиС",
+                 "+375291234567", "12345678", "Бюджет", "Нет"]
+        streams.append([f.message(u, text) for text in steps])
+    return streams
+
+
+# ====================== Замеры ======================
+class HandlerTimer(BaseMiddleware):
+    """Inner-middleware стенда: точные времена по имени хендлера (метрики отдают только бакеты)"""
+
+    def __init__(self):
+        self.timings: dict[str, list[float]] = defaultdict(list)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = getattr(data.get("handler"), "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.timings[name].append((time.perf_counter() - start) * 1000)
+
+
+def _query_count() -> int:
+    return sum(sum(counts) for counts, _ in metrics.db_query_duration.snapshot().values())
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _drain():
+    """Ждём, пока уйдут отложенные вызовы: очереди пользователей, пачки удалений и очередь Bot API"""
+    await sharding.shards.join()
+    await asyncio.sleep(config.DELETE_COALESCE_WINDOW)
+    while True:
+        stats = outbound.scheduler.stats()
+        if not stats["queued"] and not stats["in_flight"]:
+            return
+        await asyncio.sleep(0.05)
+
+
+class Run:
+    """Один прогон: латентность апдейтов, запросы в БД и вызовы Bot API с момента создания"""
+
+    def __init__(self, name: str, api: FakeBotApi, timer: HandlerTimer):
+        self.name = name
+        self.api = api
+        self.timer = timer
+        timer.timings.clear()
+        api.calls.clear()
+        self.latencies: list[float] = []
+        self.errors = 0
+        self._queries_before = _query_count()
+        # С очередями хендлер работает уже после feed_update — его ошибки считает воркер
+        self._failed_before = sharding.shards.failed
+        self._start = time.perf_counter()
+
+    async def feed(self, dp, bot, update: Update):
+        start = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.getLogger("bench").warning(f"update_id={update.update_id}: {e!r}")
+        self.latencies.append((time.perf_counter() - start) * 1000)
+
+    async def finish(self):
+        # Апдейты обработаны, когда разобраны очереди пользователей, а не когда вернулся feed_update
+        await sharding.shards.join()
+        wall = time.perf_counter() - self._start
+        await _drain()
+        self.errors += sharding.shards.failed - self._failed_before
+        total = len(self.latencies)
+        if not total:
+            print(f"\n=== {self.name}: нет апдейтов")
+            return
+        queries = _query_count() - self._queries_before
+        print(f"\n=== {self.name}: {total} апдейтов за {wall:.2f} с — {total / wall:.0f} upd/s")
+        print(
+            f"    {'приём апдейта' if config.DISPATCH_ORDERED else 'апдейт'}: p50={statistics.median(self.latencies):.2f} ms  "
+            f"p99={_percentile(self.latencies, 0.99):.2f} ms  "
+            f"запросов в БД/апдейт={queries / total:.2f}  "
+            f"вызовов API/апдейт={sum(self.api.calls.values()) / total:.2f}  ошибок={self.errors}"
+        )
+        for handler, values in sorted(self.timer.timings.items(), key=lambda kv: -len(kv[1])):
+            print(
+                f"    {handler:<28} n={len(values):<6} p50={statistics.median(values):8.2f} ms  "
+                f"p99={_percentile(values, 0.99):8.2f} ms"
+            )
+        print("    Bot API: " + ", ".join(f"{m}={c}" for m, c in self.api.calls.most_common()))
+
+
+async def run_scenario(name, streams, dp, bot, api: FakeBotApi, timer: HandlerTimer, concurrency: int):
+    # Апдейты собираем заранее, чтобы валидация pydantic не попадала в замер
+    by_stream = [[Update.model_validate(u, context={"bot": bot}) for u in stream] for stream in streams]
+    semaphore = asyncio.Semaphore(concurrency)
+    run = Run(name, api, timer)
+
+    async def feed(stream):
+        async with semaphore:
+            for update in stream:
+                await run.feed(dp, bot, update)
+
+    await asyncio.gather(*(feed(s) for s in by_stream))
+    await run.finish()
+
+
+async def cleanup():
+    await db.execute("DELETE FROM users WHERE telegram_id >= $1", BENCH_ID_BASE)
+    await db.execute("DELETE FROM admin_action_logs WHERE chat_id = $1", BENCH_CHAT_ID)
+    await db.execute("DELETE FROM pending_deletions WHERE chat_id = $1", BENCH_CHAT_ID)
+
+
+@asynccontextmanager
+async def environment(args, on_exit: Callable[[], Awaitable[Any]] | None = None):
+    """Бот и Dispatcher из main.py против фейкового Bot API и базы из .env -> (dp, bot, api, timer)"""
+    api = FakeBotApi(args.api_latency / 1000, args.api_jitter / 1000)
+    config.TELEGRAM_API_URL = await api.start()
+
+    bot = main.create_bot()
+    dp = main.create_dispatcher()
+    timer = HandlerTimer()
+    dp.message.middleware(timer)
+    dp.callback_query.middleware(timer)
+    dp.chat_member.middleware(timer)
+
+    if not args.real_limits:
+        # Меряем код бота, а не лимиты Telegram
+        outbound.scheduler.global_bucket = outbound.TokenBucket(1e9, 1e9)
+        outbound.scheduler.chat_rate_per_min = 1e9 * 60
+
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("bot_actions").setLevel(args.log_level)
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+
+    await db.init_pool()
+    try:
+        await db.load_bot_admins()
+        await resolver.setup()
+        await roster.setup()
+        if isinstance(dp.storage, PostgresStorage):
+            await dp.storage.setup()
+        admin_logger.start()
+        await deletions.scheduler.start(bot)
+        yield dp, bot, api, timer
+    finally:
+        await sharding.shards.stop()
+        await group.join_storm.stop()
+        await deletions.scheduler.stop()
+        await deletions.coalescer.stop()
+        await outbound.scheduler.stop()
+        await admin_logger.stop()
+        if on_exit:
+            await on_exit()
+        await dp.storage.close()
+        await db.close_pool()
+        await bot.session.close()
+        await api.stop()
+
+
+async def run(args):
+    async with environment(args, on_exit=cleanup) as (dp, bot, api, timer):
+        await cleanup()
+
+        f = UpdateFactory()
+        selected = args.scenarios.split(",")
+        if "join" in selected:
+            await run_scenario("join", scenario_join(f, args.users), dp, bot, api, timer, args.concurrency)
+        if "flood" in selected:
+            reg_mode.REG_MODE_ENABLED = True
+            try:
+                await run_scenario(
+                    "flood", scenario_flood(f, args.users, args.messages), dp, bot, api, timer, args.concurrency
+                )
+            finally:
+                reg_mode.REG_MODE_ENABLED = False
+        if "admin" in selected:
+            await run_scenario("admin", scenario_admin(f, args.users, args.batch), dp, bot, api, timer, args.concurrency)
+        if "register" in selected:
+            await run_scenario("register", scenario_register(f, args.users), dp, bot, api, timer, args.concurrency)
+
+
+def add_environment_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--concurrency", type=int, default=config.UPDATES_CONCURRENCY,
+                        help="апдейтов в обработке одновременно")
+    parser.add_argument("--api-latency", type=float, default=30.0, help="задержка Bot API, мс")
+    parser.add_argument("--api-jitter", type=float, default=10.0, help="разброс задержки, мс")
+    parser.add_argument("--real-limits", action="store_true", help="не снимать лимиты outbound-очереди")
+    parser.add_argument("--log-level", default="WARNING")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", default="join,flood,admin,register",
+                        help="через запятую: join,flood,admin,register")
+    parser.add_argument("--users", type=int, default=200, help="пользователей в каждом сценарии")
+    parser.add_argument("--messages", type=int, default=5, help="сообщений на пользователя во flood")
+    parser.add_argument("--batch", type=int, default=10, help="@username в одной админской команде")
+    add_environment_args(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,118 @@
+# registration_bench.py
+"""
+Микробенчмарк сохранения регистрации: старые три запроса против одного UPSERT.
+
+Запускать на тестовой базе (пишет в users строки с отрицательными telegram_id
+и удаляет их в конце):
+
+    python bench/registration_bench.py --iterations 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncpg
+
+import config
+import db
+
+DATA = {
+    "full_name": "Иванов Иван Иванович",
+    "group_number": "123456",
+    "faculty": "FKSiS",
+    "mobile_number": "+375291234567",
+    "stud_number": "12345678",
+    "form_educ": "бюджет",
+    "scholarship": True,
+}
+
+OLD_UPSERT_SQL = """
+    INSERT INTO users (
+        telegram_id, username, full_name, group_number, faculty,
+        mobile_number, stud_number, form_educ, scholarship,
+        created_at, updated_at
+    )
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW(), NOW())
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        full_name = EXCLUDED.full_name,
+        group_number = EXCLUDED.group_number,
+        faculty = EXCLUDED.faculty,
+        mobile_number = EXCLUDED.mobile_number,
+        stud_number = EXCLUDED.stud_number,
+        form_educ = EXCLUDED.form_educ,
+        scholarship = EXCLUDED.scholarship,
+        updated_at = NOW()
+"""
+
+
+def _args(user_id: int) -> tuple:
+    return (
+        user_id, f"bench{-user_id}", DATA["full_name"], DATA["group_number"], DATA["faculty"],
+        DATA["mobile_number"], DATA["stud_number"], DATA["form_educ"], DATA["scholarship"],
+    )
+
+
+async def old_registration(conn: asyncpg.Connection, user_id: int):
+    await conn.execute(OLD_UPSERT_SQL, *_args(user_id))
+    await conn.execute(
+        "UPDATE users SET is_verified = TRUE, updated_at = NOW() WHERE telegram_id = $1", user_id
+    )
+    return await conn.fetchval("SELECT group_id FROM users WHERE telegram_id = $1", user_id)
+
+
+async def new_registration(conn: asyncpg.Connection, user_id: int):
+    return await conn.fetchval(db.SAVE_REGISTRATION_SQL, *_args(user_id))
+
+
+async def measure(conn, func, iterations: int, id_offset: int) -> list[float]:
+    timings = []
+    for i in range(iterations):
+        user_id = -(id_offset + i % 100 + 1)
+        start = time.perf_counter()
+        await func(conn, user_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"{name:<18} n={len(timings):<6} mean={statistics.mean(timings):7.2f} ms  "
+        f"p50={statistics.median(timings):7.2f} ms  p99={p99:7.2f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        user=config.DATABASE["user"],
+        password=config.DATABASE["password"],
+        database=config.DATABASE["database"],
+        host=config.DATABASE["host"],
+        port=config.DATABASE["port"],
+        statement_cache_size=0,
+    )
+    try:
+        # Прогрев: строки уже существуют, дальше меряем путь ON CONFLICT
+        await measure(conn, old_registration, 100, 0)
+        await measure(conn, new_registration, 100, 1000)
+
+        report("3 запроса (было)", await measure(conn, old_registration, args.iterations, 0))
+        report("1 UPSERT (стало)", await measure(conn, new_registration, args.iterations, 1000))
+    finally:
+        await conn.execute("DELETE FROM users WHERE telegram_id < 0 AND username LIKE 'bench%'")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# replay.py
+"""
+Повтор записанного журнала апдейтов (UPDATE_JOURNAL) через Dispatcher из main.py.
+
+Окружение то же, что у load_bench.py: фейковый Bot API и база из .env.
+В журнале настоящие telegram_id — запускать только на одноразовой тестовой базе.
+
+    python bench/replay.py updates.jsonl.gz              # в реальном темпе
+    python bench/replay.py updates.jsonl.gz --speed 10   # в 10 раз быстрее
+    python bench/replay.py updates.jsonl.gz --speed 0    # без пауз, насколько успевает бот
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiogram.types import Update
+
+from journal import read_journal
+from load_bench import Run, add_environment_args, environment
+
+
+async def replay(args):
+    async with environment(args) as (dp, bot, api, timer):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        tasks = set()
+        run = Run(os.path.basename(args.journal), api, timer)
+
+        async def feed(update: Update):
+            try:
+                await run.feed(dp, bot, update)
+            finally:
+                semaphore.release()
+
+        first_ts = None
+        started = loop.time()
+        for n, (ts, raw) in enumerate(read_journal(args.journal)):
+            if args.limit and n >= args.limit:
+                break
+            if first_ts is None:
+                first_ts = ts
+            if args.speed > 0:
+                # Держим исходные интервалы между апдейтами, сжатые в speed раз
+                delay = started + (ts - first_ts) / args.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.model_validate(raw, context={"bot": bot})
+            # Если бот не успевает, дальше журнал не читаем — отставание видно по латентности
+            await semaphore.acquire()
+            task = asyncio.create_task(feed(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        await run.finish()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("journal", help="файл журнала .jsonl.gz")
+    parser.add_argument("--speed", type=float, default=1.0, help="множитель скорости, 0 — максимум")
+    parser.add_argument("--limit", type=int, default=0, help="повторить только первые N апдейтов")
+    add_environment_args(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(replay(parse_args()))
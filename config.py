@@ -17,7 +17,144 @@ DATABASE = {
     "password": os.getenv("DB_PASSWORD"),
 }
 
+# Реплика только для чтения (db.acquire_read); пустой DB_REPLICA_HOST — все чтения с primary
+REPLICA_DATABASE = {
+    "host": os.getenv("DB_REPLICA_HOST"),
+    "port": os.getenv("DB_REPLICA_PORT", DATABASE["port"]),
+    "database": os.getenv("DB_REPLICA_DB", DATABASE["database"]),
+    "user": os.getenv("DB_REPLICA_USER", DATABASE["user"]),
+    "password": os.getenv("DB_REPLICA_PASSWORD", DATABASE["password"]),
+}
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", "10"))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))  # сек, больше — читаем с primary
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))  # сек
+DB_REPLICA_PIN_TTL = float(os.getenv("DB_REPLICA_PIN_TTL", "30"))  # сек чтения с primary после записи пользователя
+DB_REPLICA_ACQUIRE_TIMEOUT = float(os.getenv("DB_REPLICA_ACQUIRE_TIMEOUT", "1"))  # сек
+
+# Prepared statements: auto | direct | pooler | off (см. db.STATEMENT_MODES)
+DB_STATEMENT_MODE = os.getenv("DB_STATEMENT_MODE", "auto")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Кэш статуса верификации (db.is_user_verified)
+VERIFIED_CACHE_SIZE = int(os.getenv("VERIFIED_CACHE_SIZE", "50000"))
+VERIFIED_CACHE_TTL = int(os.getenv("VERIFIED_CACHE_TTL", "300"))  # сек
+
+# Как часто перечитывать bot_admins из БД (правки мимо /addadmin и /deladmin)
+BOT_ADMINS_TTL = int(os.getenv("BOT_ADMINS_TTL", "60"))  # сек
+
+# Очередь записи admin_action_logs
+ADMIN_LOG_BATCH_SIZE = int(os.getenv("ADMIN_LOG_BATCH_SIZE", "200"))
+ADMIN_LOG_FLUSH_INTERVAL = float(os.getenv("ADMIN_LOG_FLUSH_INTERVAL", "1.0"))  # сек
+ADMIN_LOG_QUEUE_SIZE = int(os.getenv("ADMIN_LOG_QUEUE_SIZE", "10000"))
+# Повторов записи пачки при ошибке БД (пауза 1, 2, 4… сек); после — записи уходят в лог
+ADMIN_LOG_MAX_RETRIES = int(os.getenv("ADMIN_LOG_MAX_RETRIES", "5"))
+
+# Приём апдейтов: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "64"))  # апдейтов в обработке одновременно
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # внешний адрес, без пути; пусто — setWebhook не вызываем
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Защита от повторной доставки одного и того же update_id
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", "3600"))  # сек
+# Свой адрес Bot API (локальный сервер или фейк для нагрузочных прогонов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# FSM-хранилище: "memory" или "postgres"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+# Кэш postgres-хранилища; между процессами сбрасывается через LISTEN/NOTIFY
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = int(os.getenv("FSM_CACHE_TTL", "600"))  # сек
+# Лимиты для memory: брошенные регистрации вытесняются
+FSM_MAX_SESSIONS = int(os.getenv("FSM_MAX_SESSIONS", "10000"))
+FSM_SESSION_TTL = int(os.getenv("FSM_SESSION_TTL", "86400"))  # сек простоя
+
+# Исходящие вызовы Bot API (outbound.scheduler)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))  # в секунду на бота
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "20"))  # сообщений в минуту на группу
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "16"))
+
+# reg_mode_guard: id удаляемых сообщений копятся по чату столько секунд
+DELETE_COALESCE_WINDOW = float(os.getenv("DELETE_COALESCE_WINDOW", "0.5"))
+
+# Зачистка неверифицированных при /reg_mode on
+SWEEP_CHUNK_SIZE = int(os.getenv("SWEEP_CHUNK_SIZE", "500"))
+SWEEP_CONCURRENCY = int(os.getenv("SWEEP_CONCURRENCY", "10"))
+
+# reg_mode_guard: недавно замученных столько секунд только удаляем — без мута, записи в БД и предупреждения
+MUTED_TRACKER_TTL = int(os.getenv("MUTED_TRACKER_TTL", "60"))
+MUTED_TRACKER_SIZE = int(os.getenv("MUTED_TRACKER_SIZE", "100000"))
+# Промах кэша верификации у замученного — в БД не чаще раза за столько секунд на пользователя
+MUTED_RECHECK_INTERVAL = int(os.getenv("MUTED_RECHECK_INTERVAL", "10"))
+
+# @username -> telegram_id из увиденных апдейтов
+USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", "100000"))
+USERNAME_CACHE_TTL = int(os.getenv("USERNAME_CACHE_TTL", "604800"))  # сек
+
+# /kick, /mute, ... с несколькими целями: сколько применяем одновременно
+MODERATION_CONCURRENCY = int(os.getenv("MODERATION_CONCURRENCY", "10"))
+
+# Лимит частоты для шумных событий log_action: "action=событий/сек;action2=..."
+LOG_RATE_LIMITS = {
+    "REG_MODE: попытка писать без верификации": 5.0,
+    "REG_MODE: БД перегружена, проверка пропущена": 1.0,
+    "Повторный апдейт пропущен": 1.0,
+}
+for _item in filter(None, os.getenv("LOG_RATE_LIMITS", "").split(";")):
+    _action, _, _rate = _item.rpartition("=")
+    LOG_RATE_LIMITS[_action.strip()] = float(_rate)
+
+# Prometheus /metrics; 0 — выключено
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Журнал входящих апдейтов (.jsonl.gz) для bench/replay.py; пусто — не пишем
+UPDATE_JOURNAL = os.getenv("UPDATE_JOURNAL", "")
+
+# Очереди обработки апдейтов: апдейты одного пользователя — строго по порядку; 0 — выключено
+DISPATCH_ORDERED = os.getenv("DISPATCH_ORDERED", "1") != "0"
+# Апдейтов в очереди одного пользователя; сверх этого приём новых ждёт
+DISPATCH_USER_QUEUE = int(os.getenv("DISPATCH_USER_QUEUE", "100"))
+
+# Пул соединений: границы и стартовый лимит для контроллера (pool_control.py)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_INITIAL = int(os.getenv("DB_POOL_INITIAL", "10"))
+# Пересчёт лимита, сек; целевое ожидание соединения (p95), сек
+DB_POOL_ADJUST_INTERVAL = float(os.getenv("DB_POOL_ADJUST_INTERVAL", "5"))
+DB_POOL_TARGET_WAIT = float(os.getenv("DB_POOL_TARGET_WAIT", "0.02"))
+# Простаивающее соединение закрывается через столько секунд
+DB_POOL_IDLE_LIFETIME = float(os.getenv("DB_POOL_IDLE_LIFETIME", "60"))
+# Сколько ждать соединение и сколько ожидающих допускать, дальше — отказ
+DB_ACQUIRE_DEADLINE = float(os.getenv("DB_ACQUIRE_DEADLINE", "5"))
+DB_POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", "1000"))
+
+# /export: строк за одну выборку курсора; до какого размера файл держим в памяти
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(5 * 1024 * 1024)))  # байт
+
+# /import_roster: лимит на COPY и слияние вместо 10 с пула (SET LOCAL statement_timeout)
+ROSTER_IMPORT_TIMEOUT = float(os.getenv("ROSTER_IMPORT_TIMEOUT", "300"))  # сек
+
+# Наплыв входов: столько входов за JOIN_STORM_RATE_WINDOW сек включают пакетный режим (joins.py)
+JOIN_STORM_THRESHOLD = int(os.getenv("JOIN_STORM_THRESHOLD", "10"))
+JOIN_STORM_RATE_WINDOW = float(os.getenv("JOIN_STORM_RATE_WINDOW", "10"))
+# Пачка входов: копим столько секунд или до стольких человек (упоминаний в одном приветствии)
+JOIN_BATCH_WINDOW = float(os.getenv("JOIN_BATCH_WINDOW", "2"))
+JOIN_BATCH_MAX = int(os.getenv("JOIN_BATCH_MAX", "50"))
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле")
 if not all(DATABASE.values()):
     raise ValueError("Не все Supabase credentials найдены в .env")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"BOT_MODE должен быть polling или webhook, получено: {BOT_MODE}")
+if DB_STATEMENT_MODE not in ("auto", "direct", "pooler", "off"):
+    raise ValueError(f"DB_STATEMENT_MODE должен быть auto, direct, pooler или off, получено: {DB_STATEMENT_MODE}")
+if FSM_STORAGE not in ("memory", "postgres"):
+    raise ValueError(f"FSM_STORAGE должен быть memory или postgres, получено: {FSM_STORAGE}")
+if not 1 <= DB_POOL_MIN <= DB_POOL_MAX:
+    raise ValueError(f"Нужно 1 <= DB_POOL_MIN <= DB_POOL_MAX, получено: {DB_POOL_MIN}, {DB_POOL_MAX}")
@@ -1,21 +1,152 @@
 import asyncio
+import itertools
+import time
+import uuid
 import asyncpg
-from typing import Any, List, Optional
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional
 import config
 import logging
+import metrics
+from cache import TTLCache
+from pool_control import AdaptivePoolLimiter, PoolSaturated
 
 logger = logging.getLogger("db")
 
 pool: Optional[asyncpg.Pool] = None
+# Эффективный размер пула: подстраивается под ожидание соединений (pool_control.py)
+pool_limiter = AdaptivePoolLimiter()
+
+
+# ====================== Prepared statements ======================
+# direct — прямое подключение к Postgres, обычный кэш asyncpg;
+# pooler — pgbouncer >= 1.21 (max_prepared_statements > 0) в transaction mode:
+#          кэш включён, имена стейтментов глобально уникальны;
+# off    — кэш выключен, каждый запрос парсится заново (старое поведение).
+STATEMENT_MODES = ("direct", "pooler", "off")
+
+statement_mode = "off"
+_stmt_hits = 0
+_stmt_misses = 0
+
+
+class StatsConnection(asyncpg.Connection):
+    """Считает попадания в кэш prepared statements"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seen_statements: set[str] = set()
+
+    async def _get_statement(self, query, timeout, *, use_cache=True, **kwargs):
+        global _stmt_hits, _stmt_misses
+        statement = await super()._get_statement(query, timeout, use_cache=use_cache, **kwargs)
+        if use_cache:
+            name = statement.name
+            if name and name in self._seen_statements:
+                _stmt_hits += 1
+            else:
+                _stmt_misses += 1
+                if name:
+                    # Вытесненные из кэша имена больше не встретятся — не копим их
+                    if len(self._seen_statements) > 4 * max(config.DB_STATEMENT_CACHE_SIZE, 1):
+                        self._seen_statements.clear()
+                    self._seen_statements.add(name)
+        return statement
+
+
+class PoolerSafeConnection(StatsConnection):
+    """Уникальные имена стейтментов: за пулером соединения с сервером общие"""
+
+    def _get_unique_id(self, prefix):
+        return f"__asyncpg_{prefix}_{uuid.uuid4().hex}__"
+
+
+def is_transaction_pooler() -> bool:
+    host = (config.DATABASE["host"] or "").lower()
+    port = str(config.DATABASE["port"] or "")
+    # Supabase/Supavisor transaction pooler: порт 6543 или *.pooler.*
+    return port == "6543" or "pooler" in host or "pgbouncer" in host
+
+
+def resolve_statement_mode() -> str:
+    mode = config.DB_STATEMENT_MODE
+    if mode != "auto":
+        return mode
+    if is_transaction_pooler():
+        return "off"
+    return "direct"
+
+
+def statement_cache_stats() -> dict:
+    total = _stmt_hits + _stmt_misses
+    return {
+        "mode": statement_mode,
+        "hits": _stmt_hits,
+        "misses": _stmt_misses,
+        "hit_rate": round(_stmt_hits / total, 4) if total else 0.0,
+    }
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    conn.add_query_logger(metrics.on_query)
+
+
+def _pool_metrics():
+    if not pool:
+        return []
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    limiter = pool_limiter.stats()
+    return [
+        ("bot_db_pool_size", "Соединений в пуле", {}, size),
+        ("bot_db_pool_limit", "Текущий лимит соединений (контроллер пула)", {}, limiter["limit"]),
+        ("bot_db_pool_waiting", "Ожидают соединения", {}, limiter["waiting"]),
+        ("bot_db_pool_shed_total", "Отказов в соединении: очередь или дедлайн", {}, limiter["shed"]),
+        ("bot_db_pool_in_use", "Занятых соединений", {}, size - idle),
+        ("bot_db_pool_idle", "Свободных соединений", {}, idle),
+        ("bot_db_statement_cache_hit_rate", "Доля попаданий в кэш prepared statements", {}, statement_cache_stats()["hit_rate"]),
+        ("bot_verified_cache_hit_rate", "Доля попаданий в кэш верификации", {}, verified_cache.stats()["hit_rate"]),
+        ("bot_db_replica_healthy", "Чтения идут на реплику", {}, int(replica_healthy)),
+        ("bot_db_replica_lag_seconds", "Отставание реплики", {}, replica_lag if replica_lag is not None else -1),
+        *(
+            ("bot_db_reads_total", "Чтения по месту выполнения", {"target": target}, count)
+            for target, count in _reads.items()
+        ),
+    ]
+
+
+metrics.register_collector(_pool_metrics)
+
+
+def _connection_options() -> dict:
+    """Общие параметры соединений primary и реплики"""
+    if statement_mode == "off":
+        cache_size = 0
+        connection_class = StatsConnection
+    else:
+        cache_size = config.DB_STATEMENT_CACHE_SIZE
+        connection_class = PoolerSafeConnection if statement_mode == "pooler" else StatsConnection
+    return {
+        "command_timeout": 10,  # если запрос >10 сек — ошибка вместо зависания
+        "server_settings": {'statement_timeout': '10000'},  # 10 сек на стороне Postgres
+        "statement_cache_size": cache_size,
+        "connection_class": connection_class,
+        "init": _init_connection,
+    }
 
 
 async def init_pool():
-    global pool
+    global pool, statement_mode
     if pool:
         return
     try:
-        min_size = 5
-        max_size = 20
+        # Верхняя граница; сколько соединений реально держать, решает pool_limiter
+        min_size = config.DB_POOL_MIN
+        max_size = config.DB_POOL_MAX
+
+        statement_mode = resolve_statement_mode()
+        options = _connection_options()
+        cache_size = options["statement_cache_size"]
 
         pool = await asyncpg.create_pool(
             user=config.DATABASE["user"],
@@ -26,22 +157,29 @@ async def init_pool():
             min_size=min_size,
             max_size=max_size,
             timeout=15,
-            command_timeout=10,  # если запрос >10 сек — ошибка вместо зависания
-            server_settings={'statement_timeout': '10000'},  # 10 сек на стороне Postgres
-            statement_cache_size=0,
+            max_inactive_connection_lifetime=config.DB_POOL_IDLE_LIFETIME,
+            **options,
         )
         logger.info(
             f"Пул создан успешно | host={config.DATABASE['host']}, "
             f"port={config.DATABASE['port']}, min_size={min_size}, max_size={max_size}, "
-            f"statement_cache_size=0 (prepared statements отключены)"
+            f"limit={pool_limiter.limit}, "
+            f"statement_mode={statement_mode}, statement_cache_size={cache_size}"
         )
+        pool_limiter.start()
     except Exception as e:
         logger.exception("❌ Ошибка подключения к базе")
         raise e
 
+    if config.REPLICA_DATABASE["host"]:
+        await _connect_replica()
+        _start_replica_monitor()
+
 
 async def close_pool():
     global pool
+    await pool_limiter.stop()
+    await _close_replica()
     if pool:
         try:
             # Ждём максимум 10 секунд
@@ -56,42 +194,443 @@ async def close_pool():
         logger.info("Пул базы данных закрыт")
 
 
-async def execute(query: str, *args) -> str:
+@asynccontextmanager
+async def acquire(timeout: float | None = None) -> AsyncIterator[asyncpg.Connection]:
+    """
+    pool.acquire() через pool_limiter с замером ожидания.
+    Не дождались за timeout (по умолчанию DB_ACQUIRE_DEADLINE) — PoolSaturated.
+    """
     if not pool:
         raise RuntimeError("Pool не инициализирован. Вызовите init_pool()")
-    async with pool.acquire() as conn:
+    start = time.perf_counter()
+    await pool_limiter.acquire(timeout)
+    try:
+        async with pool.acquire() as conn:
+            wait = time.perf_counter() - start
+            pool_limiter.observe_wait(wait)
+            metrics.db_acquire_wait.observe(wait)
+            yield conn
+    finally:
+        pool_limiter.release()
+
+
+async def execute(query: str, *args) -> str:
+    async with acquire() as conn:
         return await conn.execute(query, *args)
 
 
 async def fetchval(query: str, *args) -> Any:
-    if not pool:
-        raise RuntimeError("Pool не инициализирован")
-    async with pool.acquire() as conn:
+    async with acquire() as conn:
         return await conn.fetchval(query, *args)
 
 
 async def fetchrow(query: str, *args) -> Optional[asyncpg.Record]:
-    if not pool:
-        raise RuntimeError("Pool не инициализирован")
-    async with pool.acquire() as conn:
+    async with acquire() as conn:
         return await conn.fetchrow(query, *args)
 
 
 async def fetch(query: str, *args) -> List[asyncpg.Record]:
-    if not pool:
-        raise RuntimeError("Pool не инициализирован")
-    async with pool.acquire() as conn:
+    async with acquire() as conn:
         return await conn.fetch(query, *args)
 
 
+async def connect_dedicated(**options) -> asyncpg.Connection:
+    """Отдельное соединение с primary вне пула (LISTEN, долгие DDL)"""
+    return await asyncpg.connect(
+        user=config.DATABASE["user"],
+        password=config.DATABASE["password"],
+        database=config.DATABASE["database"],
+        host=config.DATABASE["host"],
+        port=config.DATABASE["port"],
+        timeout=15,
+        statement_cache_size=0,
+        **options,
+    )
+
+
+async def ensure_index(name: str, definition: str):
+    """
+    CREATE INDEX CONCURRENTLY на отдельном соединении без таймаутов.
+    На большой таблице построение идёт дольше statement_timeout пула; прерванное
+    оставляет INVALID-индекс, который IF NOT EXISTS пропускал бы при каждом старте, —
+    такой удаляем и строим заново. definition — всё после ON, например "users (lower(username))".
+    """
+    conn = await connect_dedicated(command_timeout=None, server_settings={"statement_timeout": "0"})
+    try:
+        valid = await conn.fetchval("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name)
+        if valid:
+            return
+        if valid is False:
+            logger.warning(f"Индекс {name} невалиден (прерванное построение) — пересоздаём")
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        started = time.perf_counter()
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+        logger.info(f"Индекс {name} построен за {time.perf_counter() - started:.1f} с")
+    finally:
+        await conn.close()
+
+
+# ====================== Реплика для чтения ======================
+# Чтения идут на реплику, если она есть, жива и отстаёт не больше DB_REPLICA_MAX_LAG.
+# После записи пользователь DB_REPLICA_PIN_TTL секунд читает с primary
+# (read-your-writes): любой код, пишущий в users, вызывает pin_to_primary().
+replica_pool: Optional[asyncpg.Pool] = None
+replica_healthy = False
+replica_lag: Optional[float] = None
+_replica_monitor: Optional[asyncio.Task] = None
+_pinned = TTLCache(config.VERIFIED_CACHE_SIZE, config.DB_REPLICA_PIN_TTL)
+_reads = {"replica": 0, "primary": 0, "fallback": 0}
+
+# Ошибки, после которых реплику считаем недоступной и повторяем чтение на primary
+_REPLICA_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    OSError,
+    asyncio.TimeoutError,
+)
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def pin_to_primary(user_id: int):
+    if config.REPLICA_DATABASE["host"]:
+        _pinned.set(user_id, True)
+
+
+def _use_replica(user_id: int | None) -> bool:
+    if not replica_pool or not replica_healthy:
+        return False
+    return user_id is None or user_id not in _pinned
+
+
+def _replica_failed(e: Exception):
+    global replica_healthy
+    if replica_healthy:
+        logger.warning(f"Реплика недоступна, чтения переключены на primary: {e!r}")
+    replica_healthy = False
+
+
+async def _read(method: str, query: str, args: tuple, user_id: int | None):
+    if _use_replica(user_id):
+        try:
+            async with replica_pool.acquire(timeout=config.DB_REPLICA_ACQUIRE_TIMEOUT) as conn:
+                result = await getattr(conn, method)(query, *args)
+            _reads["replica"] += 1
+            return result
+        except _REPLICA_ERRORS as e:
+            _replica_failed(e)
+            _reads["fallback"] += 1
+    else:
+        _reads["primary"] += 1
+    async with acquire() as conn:
+        return await getattr(conn, method)(query, *args)
+
+
+@asynccontextmanager
+async def acquire_read(user_id: int | None = None) -> AsyncIterator[asyncpg.Connection]:
+    """Соединение для нескольких чтений подряд (курсоры, транзакции) — с реплики, если можно"""
+    if _use_replica(user_id):
+        try:
+            conn = await replica_pool.acquire(timeout=config.DB_REPLICA_ACQUIRE_TIMEOUT)
+        except _REPLICA_ERRORS as e:
+            _replica_failed(e)
+            _reads["fallback"] += 1
+        else:
+            _reads["replica"] += 1
+            try:
+                yield conn
+            finally:
+                await replica_pool.release(conn)
+            return
+    else:
+        _reads["primary"] += 1
+    async with acquire() as conn:
+        yield conn
+
+
+async def fetchval_read(query: str, *args, user_id: int | None = None) -> Any:
+    """fetchval с реплики; user_id — для read-your-writes"""
+    return await _read("fetchval", query, args, user_id)
+
+
+async def fetchrow_read(query: str, *args, user_id: int | None = None) -> Optional[asyncpg.Record]:
+    return await _read("fetchrow", query, args, user_id)
+
+
+async def fetch_read(query: str, *args, user_id: int | None = None) -> List[asyncpg.Record]:
+    return await _read("fetch", query, args, user_id)
+
+
+def replica_stats() -> dict:
+    return {
+        "enabled": bool(config.REPLICA_DATABASE["host"]),
+        "healthy": replica_healthy,
+        "lag": replica_lag,
+        "pinned": len(_pinned),
+        **{f"reads_{k}": v for k, v in _reads.items()},
+    }
+
+
+async def _connect_replica():
+    global replica_pool
+    try:
+        replica_pool = await asyncpg.create_pool(
+            user=config.REPLICA_DATABASE["user"],
+            password=config.REPLICA_DATABASE["password"],
+            database=config.REPLICA_DATABASE["database"],
+            host=config.REPLICA_DATABASE["host"],
+            port=config.REPLICA_DATABASE["port"],
+            min_size=1,
+            max_size=config.DB_REPLICA_POOL_MAX,
+            timeout=5,
+            max_inactive_connection_lifetime=config.DB_POOL_IDLE_LIFETIME,
+            **_connection_options(),
+        )
+        logger.info(f"Пул реплики создан | host={config.REPLICA_DATABASE['host']}")
+    except Exception as e:
+        # Бот работает и без реплики, монитор попробует подключиться ещё раз
+        logger.error(f"Не удалось подключиться к реплике: {e!r}")
+        return
+    await _check_replica()
+
+
+async def _check_replica():
+    global replica_healthy, replica_lag
+    try:
+        async with replica_pool.acquire(timeout=config.DB_REPLICA_ACQUIRE_TIMEOUT) as conn:
+            lag = float(await conn.fetchval(REPLICA_LAG_SQL, timeout=config.DB_REPLICA_ACQUIRE_TIMEOUT))
+    except Exception as e:
+        replica_lag = None
+        _replica_failed(e)
+        return
+    replica_lag = lag
+    healthy = lag <= config.DB_REPLICA_MAX_LAG
+    if healthy and not replica_healthy:
+        logger.info(f"Реплика доступна (lag={lag:.1f} с), чтения идут на неё")
+    elif not healthy and replica_healthy:
+        logger.warning(f"Реплика отстаёт на {lag:.1f} с, чтения переключены на primary")
+    replica_healthy = healthy
+
+
+async def _monitor_replica():
+    while True:
+        await asyncio.sleep(config.DB_REPLICA_CHECK_INTERVAL)
+        try:
+            if replica_pool:
+                await _check_replica()
+            else:
+                await _connect_replica()
+        except Exception as e:
+            logger.error(f"Ошибка проверки реплики: {e!r}")
+
+
+def _start_replica_monitor():
+    global _replica_monitor
+    if not _replica_monitor:
+        _replica_monitor = asyncio.create_task(_monitor_replica())
+
+
+async def _close_replica():
+    global replica_pool, replica_healthy, _replica_monitor
+    if _replica_monitor:
+        _replica_monitor.cancel()
+        try:
+            await _replica_monitor
+        except asyncio.CancelledError:
+            pass
+        _replica_monitor = None
+    replica_healthy = False
+    if replica_pool:
+        try:
+            await asyncio.wait_for(replica_pool.close(), timeout=10)
+        except Exception:
+            replica_pool.terminate()
+        replica_pool = None
+
+
+# ====================== Кэш верификации ======================
+# telegram_id -> is_verified. Любой код, меняющий is_verified в БД,
+# обязан вызвать set_verified_cached() или invalidate_verified().
+verified_cache = TTLCache(config.VERIFIED_CACHE_SIZE, config.VERIFIED_CACHE_TTL)
+# telegram_id -> номер последнего изменения: чтение из БД, начатое до изменения,
+# не должно записать в кэш устаревший статус
+_verified_changes = TTLCache(config.VERIFIED_CACHE_SIZE, config.VERIFIED_CACHE_TTL)
+_change_seq = itertools.count(1)
+
+
+def _mark_verified_changed(user_id: int):
+    _verified_changes.set(user_id, next(_change_seq))
+
+
+def set_verified_cached(user_id: int, verified: bool):
+    _mark_verified_changed(user_id)
+    verified_cache.set(user_id, bool(verified))
+    # is_verified меняется только вместе с записью в users
+    pin_to_primary(user_id)
+
+
+def invalidate_verified(user_id: int):
+    _mark_verified_changed(user_id)
+    verified_cache.pop(user_id)
+    pin_to_primary(user_id)
+
+
+def verified_cache_stats() -> dict:
+    return verified_cache.stats()
+
+
 async def is_user_verified(user_id: int) -> bool:
+    """
+    PoolSaturated пробрасывается: при перегрузке статус неизвестен,
+    и модерация не должна принять верифицированного за нового.
+    """
+    cached = verified_cache.get(user_id)
+    if cached is not None:
+        return cached
+    change = _verified_changes.get(user_id)
     try:
-        val = await fetchval("SELECT is_verified FROM users WHERE telegram_id = $1", user_id)
-        return bool(val)
+        val = await fetchval_read("SELECT is_verified FROM users WHERE telegram_id = $1", user_id, user_id=user_id)
+        verified = bool(val)
+        if _verified_changes.get(user_id) == change:
+            verified_cache.set(user_id, verified)
+        else:
+            # Пока шло чтение, статус поменяли — свежее значение уже в кэше
+            verified = verified_cache.get(user_id, verified)
+        return verified
+    except PoolSaturated:
+        raise
     except Exception as e:
         logger.error(f"Ошибка проверки верификации пользователя {user_id}: {e}")
         return False
 
+# ====================== Пользователи ======================
+# Каждая операция — один SQL-запрос, то есть один round trip и атомарность
+# без явной транзакции.
+
+SAVE_REGISTRATION_SQL = """
+    INSERT INTO users (
+        telegram_id, username, full_name, group_number, faculty,
+        mobile_number, stud_number, form_educ, scholarship,
+        is_verified, created_at, updated_at
+    )
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, TRUE, NOW(), NOW())
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        full_name = EXCLUDED.full_name,
+        group_number = EXCLUDED.group_number,
+        faculty = EXCLUDED.faculty,
+        mobile_number = EXCLUDED.mobile_number,
+        stud_number = EXCLUDED.stud_number,
+        form_educ = EXCLUDED.form_educ,
+        scholarship = EXCLUDED.scholarship,
+        is_verified = TRUE,
+        updated_at = NOW()
+    RETURNING group_id
+"""
+
+TOUCH_USER_SQL = """
+    INSERT INTO users (telegram_id, username, is_verified)
+    VALUES ($1, $2, FALSE)
+    ON CONFLICT (telegram_id) DO UPDATE
+    SET username = EXCLUDED.username
+    RETURNING is_verified
+"""
+
+
+async def save_registration(user_id: int, username: str | None, data: dict) -> Optional[int]:
+    """
+    Сохраняет анкету и ставит is_verified = TRUE (group_id не трогает).
+    Возвращает group_id пользователя.
+    """
+    group_id = await fetchval(
+        SAVE_REGISTRATION_SQL,
+        user_id,
+        username,
+        data.get("full_name"),
+        data.get("group_number"),
+        data.get("faculty"),
+        data.get("mobile_number"),
+        data.get("stud_number"),
+        data.get("form_educ"),
+        data.get("scholarship"),
+    )
+    set_verified_cached(user_id, True)
+    return group_id
+
+
+async def touch_user(user_id: int, username: str | None) -> bool:
+    """Создаёт пользователя или обновляет username. Возвращает is_verified"""
+    verified = bool(await fetchval(TOUCH_USER_SQL, user_id, username))
+    set_verified_cached(user_id, verified)
+    return verified
+
+
+# ====================== Кэш админов бота ======================
+# Весь список bot_admins держим в памяти. /addadmin и /deladmin правят его
+# сразу, раз в BOT_ADMINS_TTL он перечитывается в фоне. Версия защищает от
+# того, что фоновое чтение затрёт более свежую локальную правку.
+_bot_admins: set[int] = set()
+_bot_admins_loaded_at = 0.0
+_bot_admins_version = 0
+_bot_admins_refresh: Optional[asyncio.Task] = None
+
+
+async def load_bot_admins():
+    global _bot_admins, _bot_admins_loaded_at
+    version = _bot_admins_version
+    rows = await fetch("SELECT telegram_id FROM bot_admins")
+    if version != _bot_admins_version:
+        # Пока читали — был /addadmin или /deladmin, повторим позже
+        return
+    _bot_admins = {r["telegram_id"] for r in rows}
+    _bot_admins_loaded_at = time.monotonic()
+    logger.info(f"Админы бота загружены: {len(_bot_admins)}")
+
+
+async def _refresh_bot_admins():
+    try:
+        await load_bot_admins()
+    except Exception as e:
+        logger.error(f"Ошибка обновления списка админов: {e}")
+
+
+def _maybe_refresh_bot_admins():
+    global _bot_admins_refresh
+    if time.monotonic() - _bot_admins_loaded_at < config.BOT_ADMINS_TTL:
+        return
+    if _bot_admins_refresh and not _bot_admins_refresh.done():
+        return
+    if not pool:
+        return
+    _bot_admins_refresh = asyncio.create_task(_refresh_bot_admins())
+
+
+def is_bot_admin_cached(user_id: int) -> bool:
+    _maybe_refresh_bot_admins()
+    return user_id in _bot_admins
+
+
+async def add_bot_admin(user_id: int):
+    global _bot_admins_version
+    await execute("INSERT INTO bot_admins (telegram_id) VALUES ($1) ON CONFLICT DO NOTHING", user_id)
+    _bot_admins.add(user_id)
+    _bot_admins_version += 1
+
+
+async def remove_bot_admin(user_id: int):
+    global _bot_admins_version
+    await execute("DELETE FROM bot_admins WHERE telegram_id = $1", user_id)
+    _bot_admins.discard(user_id)
+    _bot_admins_version += 1
+
+
 def get_pool():
     if not pool:
         raise RuntimeError("Pool не инициализирован")
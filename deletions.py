@@ -0,0 +1,257 @@
+# deletions.py
+import asyncio
+import heapq
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+from aiogram import Bot
+
+import config
+import db
+import metrics
+import outbound
+from outbound import PRIORITY_MODERATION
+
+logger = logging.getLogger("deletions")
+
+TABLE_NAME = "pending_deletions"
+BULK_LIMIT = 100  # deleteMessages принимает до 100 id
+
+
+async def bulk_delete(bot: Bot, chat_id: int, message_ids: list[int]) -> tuple[int, int]:
+    """
+    Удаляет до 100 сообщений одним deleteMessages, при ошибке — по одному.
+    Возвращает (сколько удалено, сколько вызовов API потрачено).
+    """
+    try:
+        await outbound.scheduler.submit(
+            lambda: bot.delete_messages(chat_id=chat_id, message_ids=message_ids),
+            chat_id=chat_id,
+            priority=PRIORITY_MODERATION,
+        )
+        return len(message_ids), 1
+    except Exception as e:
+        logger.warning(f"deleteMessages chat_id={chat_id} не удался ({e}), удаляем по одному")
+
+    deleted = 0
+    for message_id in message_ids:
+        try:
+            await outbound.scheduler.submit(
+                lambda m=message_id: bot.delete_message(chat_id=chat_id, message_id=m),
+                chat_id=chat_id,
+                priority=PRIORITY_MODERATION,
+            )
+            deleted += 1
+        except Exception:
+            # Уже удалено руками или старше 48 часов — пропускаем
+            pass
+    return deleted, 1 + len(message_ids)
+
+
+class DeletionScheduler:
+    """
+    Отложенное удаление сообщений бота одним фоновым таском.
+
+    Вместо корутины со sleep на каждое сообщение — куча (delete_at, chat_id, message_id).
+    Новые записи сохраняются в pending_deletions, так что после рестарта
+    удаление всё равно произойдёт. Созревшие удаляются пачками по чатам.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self._heap: list[tuple[float, int, int]] = []
+        self._unsaved: list[tuple[float, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.deleted = 0
+        self.api_calls = 0
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        item = (time.time() + delay, chat_id, message_id)
+        heapq.heappush(self._heap, item)
+        self._unsaved.append(item)
+        self._wakeup.set()
+
+    async def start(self, bot: Bot):
+        if self._worker:
+            return
+        self.bot = bot
+        try:
+            await db.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    chat_id    BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    delete_at  TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (chat_id, message_id)
+                )
+            """)
+            rows = await db.fetch(
+                f"SELECT chat_id, message_id, EXTRACT(EPOCH FROM delete_at)::float8 AS ts FROM {TABLE_NAME}"
+            )
+            for r in rows:
+                heapq.heappush(self._heap, (r["ts"], r["chat_id"], r["message_id"]))
+            logger.info(f"Отложенных удалений восстановлено: {len(rows)}")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить отложенные удаления: {e}")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._worker:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # Несохранённые допишем — удалятся после рестарта
+        await self._save_new()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._heap), "deleted": self.deleted, "api_calls": self.api_calls}
+
+    async def _run(self):
+        while True:
+            if self._unsaved:
+                await self._save_new()
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            if due:
+                await self._delete_due(due)
+                continue
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _save_new(self):
+        if not self._unsaved:
+            return
+        batch, self._unsaved = self._unsaved, []
+        try:
+            await self._insert(batch)
+        except asyncio.CancelledError:
+            # stop() отменил воркер посреди записи — пачку допишет финальный _save_new()
+            # (повторная запись безопасна: ON CONFLICT)
+            self._unsaved = batch + self._unsaved
+            raise
+        except Exception as e:
+            # Не страшно: в памяти запись есть, потеряется только при рестарте
+            logger.error(f"Не удалось сохранить {len(batch)} отложенных удалений: {e}")
+
+    async def _insert(self, batch: list[tuple[float, int, int]]):
+        await db.execute(f"""
+            INSERT INTO {TABLE_NAME} (chat_id, message_id, delete_at)
+            SELECT c, m, to_timestamp(t)
+            FROM UNNEST($1::bigint[], $2::bigint[], $3::float8[]) AS x(c, m, t)
+            ON CONFLICT (chat_id, message_id) DO UPDATE SET delete_at = EXCLUDED.delete_at
+        """, [i[1] for i in batch], [i[2] for i in batch], [i[0] for i in batch])
+
+    async def _delete_due(self, due: list[tuple[float, int, int]]):
+        by_chat: dict[int, list[int]] = defaultdict(list)
+        for _, chat_id, message_id in due:
+            by_chat[chat_id].append(message_id)
+
+        await asyncio.gather(*(
+            self._delete_chat(chat_id, ids[i:i + BULK_LIMIT])
+            for chat_id, ids in by_chat.items()
+            for i in range(0, len(ids), BULK_LIMIT)
+        ))
+
+        try:
+            await db.execute(
+                f"DELETE FROM {TABLE_NAME} t USING UNNEST($1::bigint[], $2::bigint[]) AS x(c, m) "
+                f"WHERE t.chat_id = x.c AND t.message_id = x.m",
+                [i[1] for i in due], [i[2] for i in due],
+            )
+        except Exception as e:
+            logger.error(f"Не удалось убрать выполненные удаления из {TABLE_NAME}: {e}")
+
+    async def _delete_chat(self, chat_id: int, message_ids: list[int]):
+        deleted, calls = await bulk_delete(self.bot, chat_id, message_ids)
+        self.deleted += deleted
+        self.api_calls += calls
+
+
+class DeletionCoalescer:
+    """
+    Немедленное удаление, собранное в пачки: id копятся по чату COALESCE_WINDOW сек
+    (или до 100 штук) и уходят одним deleteMessages.
+    """
+
+    def __init__(self, window: float = config.DELETE_COALESCE_WINDOW):
+        self.window = window
+        self._buffers: dict[int, list[int]] = {}
+        self._bots: dict[int, Bot] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.messages = 0
+        self.deleted = 0
+        self.api_calls = 0
+
+    def delete(self, bot: Bot, chat_id: int, message_id: int):
+        self.messages += 1
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            buffer = self._buffers[chat_id] = []
+            self._bots[chat_id] = bot
+            asyncio.get_running_loop().call_later(self.window, self._flush_soon, chat_id)
+        buffer.append(message_id)
+        if len(buffer) >= BULK_LIMIT:
+            self._flush_soon(chat_id)
+
+    def _flush_soon(self, chat_id: int):
+        message_ids = self._buffers.pop(chat_id, None)
+        bot = self._bots.pop(chat_id, None)
+        if not message_ids:
+            # Буфер уже ушёл по переполнению
+            return
+        task = asyncio.create_task(self._flush(bot, chat_id, message_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, bot: Bot, chat_id: int, message_ids: list[int]):
+        deleted, calls = await bulk_delete(bot, chat_id, message_ids)
+        self.deleted += deleted
+        self.api_calls += calls
+
+    async def stop(self):
+        for chat_id in list(self._buffers):
+            self._flush_soon(chat_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "deleted": self.deleted,
+            "api_calls": self.api_calls,
+            # Без пачек было бы по вызову на удалённое сообщение; откат по одному может стоить больше
+            "api_calls_saved": max(0, self.deleted - self.api_calls),
+        }
+
+
+scheduler = DeletionScheduler()
+coalescer = DeletionCoalescer()
+
+
+def _deletion_metrics():
+    samples = [
+        (f"bot_delete_scheduled_{name}", "Отложенные удаления", {}, value)
+        for name, value in scheduler.stats().items()
+    ]
+    samples += [
+        (f"bot_delete_coalesced_{name}", "Пакетные удаления reg_mode_guard", {}, value)
+        for name, value in coalescer.stats().items()
+    ]
+    return samples
+
+
+metrics.register_collector(_deletion_metrics)
@@ -0,0 +1,318 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Mapping
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.types import Update
+
+import config
+import db
+from cache import TTLCache
+
+logger = logging.getLogger("fsm_storage")
+
+
+class _Record:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: str | None = None, data: dict | None = None):
+        self.state = state
+        self.data = data if data is not None else {}
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _state_name(state: StateType) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+# ====================== Память ======================
+class BoundedMemoryStorage(BaseStorage):
+    """
+    FSM в памяти с ограничением размера.
+
+    Сессии упорядочены по последнему обращению: брошенные /reg и /update
+    вытесняются по FSM_SESSION_TTL простоя или когда их больше FSM_MAX_SESSIONS.
+    Пустые сессии (state=None, data={}) не хранятся вовсе.
+    """
+
+    def __init__(self, max_sessions: int = config.FSM_MAX_SESSIONS, idle_ttl: float = config.FSM_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # key -> (last_access, record)
+        self.storage: "OrderedDict[StorageKey, tuple[float, _Record]]" = OrderedDict()
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    def _evict(self, now: float):
+        # Самые давние обращения — в начале
+        while self.storage:
+            key, (last_access, _) = next(iter(self.storage.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            del self.storage[key]
+            self.evicted_idle += 1
+        while len(self.storage) > self.max_sessions:
+            self.storage.popitem(last=False)
+            self.evicted_lru += 1
+
+    def _get(self, key: StorageKey) -> _Record | None:
+        now = time.monotonic()
+        self._evict(now)
+        item = self.storage.get(key)
+        if item is None:
+            return None
+        self.storage[key] = (now, item[1])
+        self.storage.move_to_end(key)
+        return item[1]
+
+    def _put(self, key: StorageKey, record: _Record):
+        if record.is_empty():
+            self.storage.pop(key, None)
+            return
+        self.storage[key] = (time.monotonic(), record)
+        self.storage.move_to_end(key)
+        self._evict(time.monotonic())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key) or _Record()
+        record.state = _state_name(state)
+        self._put(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        record = self._get(key) or _Record()
+        record.data = data.copy()
+        self._put(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self.storage),
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+        }
+
+    async def close(self) -> None:
+        self.storage.clear()
+
+
+# ====================== Postgres ======================
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm_storage на общем пуле db.pool.
+
+    Чтения идут из кэша в памяти (в БД — только при промахе).
+    Записи копятся в self._dirty и уходят одним запросом в flush(),
+    который FSMFlushMiddleware вызывает после обработки каждого апдейта.
+
+    Процессов бота может быть несколько: flush() тем же запросом шлёт
+    NOTIFY с изменёнными ключами, и остальные процессы выкидывают их из кэша.
+    Пока LISTEN-соединения нет (не поднялось, оборвалось, пулер в transaction
+    mode его не держит), кэш не используется — читаем из БД.
+    """
+
+    CHANNEL = "fsm_storage_changed"
+
+    def __init__(self, table: str = "fsm_storage"):
+        self.table = table
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache = TTLCache(config.FSM_CACHE_SIZE, config.FSM_CACHE_TTL)
+        self._dirty: dict[str, _Record] = {}
+        # Пачки, которые flush() пишет прямо сейчас (их может быть несколько одновременно)
+        self._flushing: list[dict[str, _Record]] = []
+        # Метка этого процесса: свои уведомления пропускаем
+        self._origin = uuid.uuid4().hex
+        self._listener = None
+        self._reconnect: asyncio.Task | None = None
+        self._closing = False
+        # Растёт с каждым пришедшим уведомлением: чтение, во время которого оно пришло, не кэшируем
+        self._epoch = 0
+
+    async def setup(self):
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                key        TEXT PRIMARY KEY,
+                state      TEXT,
+                data       JSONB NOT NULL DEFAULT '{{}}',
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        await self._listen()
+
+    # ---------- инвалидация между процессами ----------
+    async def _listen(self):
+        if db.is_transaction_pooler():
+            # LISTEN через пулер в transaction mode уведомлений не получает
+            logger.info("FSM за пулером в transaction mode — читается без кэша")
+            return
+        try:
+            conn = await db.connect_dedicated()
+            await conn.add_listener(self.CHANNEL, self._on_notify)
+        except Exception as e:
+            logger.warning(f"LISTEN {self.CHANNEL} недоступен, FSM читается без кэша: {e}")
+            self._schedule_reconnect()
+            return
+        conn.add_termination_listener(self._on_terminated)
+        # Пока слушателя не было, чужие изменения могли пройти мимо
+        self.cache.clear()
+        self._listener = conn
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        origin, _, k = payload.partition("|")
+        if origin != self._origin:
+            self._epoch += 1
+            self.cache.pop(k)
+
+    def _on_terminated(self, conn):
+        self._listener = None
+        self.cache.clear()
+        logger.warning("LISTEN-соединение FSM оборвалось, кэш выключен до переподключения")
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing or (self._reconnect and not self._reconnect.done()):
+            return
+
+        async def reconnect():
+            await asyncio.sleep(5)
+            await self._listen()
+
+        self._reconnect = asyncio.create_task(reconnect())
+
+    # ---------- чтение/запись ----------
+    async def _load(self, key: StorageKey) -> tuple[str, _Record]:
+        k = self.key_builder.build(key)
+        record = self._dirty.get(k)
+        if record is None:
+            # Свежие пачки — последними: берём самую новую версию
+            for batch in reversed(self._flushing):
+                record = batch.get(k)
+                if record is not None:
+                    break
+        if record is None and self._listener is not None:
+            record = self.cache.get(k)
+        if record is None:
+            epoch = self._epoch
+            row = await db.fetchrow(f"SELECT state, data FROM {self.table} WHERE key = $1", k)
+            record = _Record(row["state"], json.loads(row["data"])) if row else _Record()
+            if self._listener is not None and epoch == self._epoch and k not in self._dirty:
+                self.cache.set(k, record)
+        return k, record
+
+    def _mark_dirty(self, k: str, record: _Record):
+        self.cache.set(k, record)
+        self._dirty[k] = record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, record = await self._load(key)
+        record.state = _state_name(state)
+        self._mark_dirty(k, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._load(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        k, record = await self._load(key)
+        record.data = data.copy()
+        self._mark_dirty(k, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._load(key)
+        return record.data.copy()
+
+    async def flush(self):
+        """
+        Пишет все изменённые ключи одним запросом: UPSERT непустых + DELETE очищенных
+        и NOTIFY по каждому ключу для кэшей других процессов
+        """
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        self._flushing.append(batch)
+
+        upsert_keys, states, datas, delete_keys = [], [], [], []
+        for k, record in batch.items():
+            if record.is_empty():
+                delete_keys.append(k)
+            else:
+                upsert_keys.append(k)
+                states.append(record.state)
+                datas.append(json.dumps(record.data, ensure_ascii=False, default=str))
+
+        try:
+            await db.execute(f"""
+                WITH deleted AS (
+                    DELETE FROM {self.table} WHERE key = ANY($4::text[])
+                    RETURNING key
+                ),
+                upserted AS (
+                    INSERT INTO {self.table} (key, state, data, updated_at)
+                    SELECT k, s, d, NOW()
+                    FROM UNNEST($1::text[], $2::text[], $3::jsonb[]) AS t(k, s, d)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = EXCLUDED.state,
+                        data = EXCLUDED.data,
+                        updated_at = NOW()
+                    RETURNING key
+                )
+                SELECT pg_notify('{self.CHANNEL}', $5 || '|' || key)
+                FROM (SELECT key FROM deleted UNION ALL SELECT key FROM upserted) AS changed
+            """, upsert_keys, states, datas, delete_keys, self._origin)
+        except Exception as e:
+            logger.error(f"Ошибка записи FSM ({len(batch)} ключей): {e}")
+            # Вернём в очередь то, что не перезаписали за время запроса
+            for k, record in batch.items():
+                self._dirty.setdefault(k, record)
+        finally:
+            self._flushing = [b for b in self._flushing if b is not batch]
+
+    async def close(self) -> None:
+        self._closing = True
+        await self.flush()
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.remove_termination_listener(self._on_terminated)
+            await listener.close()
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: после апдейта сбрасывает накопленные изменения FSM"""
+
+    def __init__(self, storage: PostgresStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
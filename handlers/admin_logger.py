@@ -1,8 +1,31 @@
 # admin_logger.py
+import asyncio
 import datetime
+import logging
+
+import config
 import db  # твой модуль с asyncpg pool
 
 TABLE_NAME = "admin_action_logs"
+COLUMNS = (
+    "action",
+    "admin_telegram_id",
+    "admin_username",
+    "target_telegram_id",
+    "target_username",
+    "chat_id",
+    "created_at",
+)
+
+logger = logging.getLogger("admin_logger")
+
+# Очередь записей: хендлеры только кладут, пишет в БД один фоновый таск пачками
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_STOP = object()
+# Пачка, которую воркер сейчас пишет (в том числе с повторами)
+_inflight: list[tuple] = []
+
 
 async def log_admin_action(
     admin_id: int,
@@ -12,7 +35,7 @@ async def log_admin_action(
     target_username: str | None = None,
     chat_id: int | None = None,
 ):
-    """Логирование действий админов в таблицу admin_action_logs"""
+    """Логирование действий админов в таблицу admin_action_logs (через очередь)"""
     if admin_username is None:
         admin_username = ""
 
@@ -20,28 +43,107 @@ async def log_admin_action(
         target_username = ""
 
     now = datetime.datetime.utcnow()
+    record = (action, admin_id, admin_username, target_id, target_username, chat_id, now)
+
+    if _queue is None:
+        # Очередь не запущена (скрипты, отладка) — пишем сразу
+        if not await _write_batch([record]):
+            _dump([record])
+        return
 
+    # Если очередь заполнена — ждём здесь, это и есть backpressure
+    await _queue.put(record)
+
+
+async def _write_batch(batch: list[tuple]) -> bool:
     try:
-        async with db.pool.acquire() as conn:
-            await conn.execute(
-                f"""
-                INSERT INTO {TABLE_NAME} (
-                    action,
-                    admin_telegram_id,
-                    admin_username,
-                    target_telegram_id,
-                    target_username,
-                    chat_id,
-                    created_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7)
-                """,
-                action,
-                admin_id,
-                admin_username,
-                target_id,
-                target_username,
-                chat_id,
-                now,
-            )
+        async with db.acquire() as conn:
+            await conn.copy_records_to_table(TABLE_NAME, records=batch, columns=COLUMNS)
+        return True
     except Exception as e:
-        print(f"[ADMIN_LOG ERROR] {e}")
\ No newline at end of file
+        logger.error(f"[ADMIN_LOG ERROR] не записано {len(batch)} записей: {e}")
+        return False
+
+
+def _dump(batch: list[tuple]):
+    """Последний рубеж: записи, которые так и не попали в БД, — хотя бы в лог"""
+    for record in batch:
+        logger.error(f"[ADMIN_LOG LOST] {dict(zip(COLUMNS, map(str, record)))}")
+
+
+async def _write_with_retry(batch: list[tuple]):
+    """Пишет пачку, при ошибке повторяет с паузой 1, 2, 4… сек (не больше ADMIN_LOG_MAX_RETRIES раз)"""
+    global _inflight
+    _inflight = batch
+    delay = 1.0
+    for attempt in range(config.ADMIN_LOG_MAX_RETRIES + 1):
+        if await _write_batch(batch):
+            break
+        if attempt == config.ADMIN_LOG_MAX_RETRIES:
+            _dump(batch)
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+    _inflight = []
+
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await _queue.get()
+        if item is _STOP:
+            break
+        batch = [item]
+        deadline = loop.time() + config.ADMIN_LOG_FLUSH_INTERVAL
+
+        # Добираем пачку до размера или до истечения интервала
+        while len(batch) < config.ADMIN_LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _write_with_retry(batch)
+
+
+def start():
+    global _queue, _worker
+    if _worker:
+        return
+    _queue = asyncio.Queue(maxsize=config.ADMIN_LOG_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run())
+
+
+async def stop():
+    """Дописывает всё, что осталось в очереди. Вызывать до db.close_pool()"""
+    global _queue, _worker
+    if not _worker:
+        return
+    await _queue.put(_STOP)
+    try:
+        await asyncio.wait_for(asyncio.shield(_worker), timeout=15)
+    except asyncio.TimeoutError:
+        logger.warning("Очередь логов админов не успела записаться за 15 сек — финальная запись")
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        # Пачка, застрявшая в повторах, и всё, что осталось в очереди, — одной попыткой
+        rest = list(_inflight)
+        while not _queue.empty():
+            item = _queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        if rest and not await _write_batch(rest):
+            _dump(rest)
+    _queue = None
+    _worker = None
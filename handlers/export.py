@@ -0,0 +1,191 @@
+# export.py
+import asyncio
+import codecs
+import csv
+import tempfile
+from datetime import datetime
+
+from aiogram import Router, F, Bot
+from aiogram.types import Message, InputFile
+
+import config
+import db
+import outbound
+from handlers.admin_logger import log_admin_action
+from handlers.group import is_bot_admin
+from handlers.registration import FACULTIES, FACULTY_REVERSE
+from utils import log_action
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX — по желанию: pip install openpyxl
+    Workbook = None
+
+router = Router(name="export")
+
+# Лимит Bot API на отправку файла ботом
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+COLUMNS = (
+    ("telegram_id", "Telegram ID"),
+    ("username", "Username"),
+    ("full_name", "ФИО"),
+    ("group_number", "Группа"),
+    ("faculty", "Факультет"),
+    ("mobile_number", "Телефон"),
+    ("stud_number", "Студ. билет"),
+    ("form_educ", "Форма обучения"),
+    ("scholarship", "Стипендия"),
+    ("is_verified", "Верифицирован"),
+    ("group_id", "Чат"),
+    ("created_at", "Создан"),
+    ("updated_at", "Обновлён"),
+)
+
+USAGE = (
+    "Использование: /export [faculty=ФКСиС] [group=123456] [verified=yes|no|all] [format=csv|xlsx]\n"
+    "По умолчанию — все верифицированные, CSV."
+)
+
+
+class SpooledInputFile(InputFile):
+    """Отправка файла из SpooledTemporaryFile кусками, без копии в памяти"""
+
+    def __init__(self, file, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot: Bot):
+        # С начала — outbound может повторить отправку после RetryAfter
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+def parse_filters(text: str) -> tuple[str, list, str] | None:
+    """-> (WHERE, параметры, формат) или None, если аргументы не распознаны"""
+    conditions = []
+    params = []
+    verified = "yes"
+    fmt = "csv"
+    for arg in text.split()[1:]:
+        key, _, value = arg.partition("=")
+        if not value:
+            return None
+        if key == "faculty":
+            code = FACULTIES.get(value, value)
+            if code not in FACULTY_REVERSE:
+                return None
+            params.append(code)
+            conditions.append(f"faculty = ${len(params)}")
+        elif key == "group":
+            params.append(value)
+            conditions.append(f"group_number = ${len(params)}")
+        elif key == "verified" and value in ("yes", "no", "all"):
+            verified = value
+        elif key == "format" and value in ("csv", "xlsx"):
+            fmt = value
+        else:
+            return None
+    if verified != "all":
+        conditions.append("is_verified" if verified == "yes" else "is_verified = FALSE")
+    where = " AND ".join(conditions) or "TRUE"
+    return where, params, fmt
+
+
+def _cell(value):
+    if isinstance(value, bool):
+        return "Да" if value else "Нет"
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+async def write_export(where: str, params: list, fmt: str, user_id: int):
+    """
+    Построчно пишет выгрузку во временный файл (в памяти до EXPORT_SPOOL_SIZE, дальше на диске).
+    Строки приходят серверным курсором пачками по EXPORT_CHUNK_SIZE;
+    соединение занято только на время чтения. Возвращает (файл, число строк).
+    """
+    query = f"""
+        SELECT {", ".join(name for name, _ in COLUMNS)}
+        FROM users
+        WHERE {where}
+        ORDER BY faculty, group_number, full_name, telegram_id
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_SIZE, mode="w+b")
+    rows = 0
+    try:
+        if fmt == "xlsx":
+            # write_only: строки не копятся в памяти, а сразу уходят во временный XML
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("users")
+            sheet.append([title for _, title in COLUMNS])
+            write_row = sheet.append
+        else:
+            # utf-8-sig — чтобы Excel открыл кириллицу без танцев
+            text = codecs.getwriter("utf-8")(spool)
+            spool.write(codecs.BOM_UTF8)
+            writer = csv.writer(text)
+            writer.writerow([title for _, title in COLUMNS])
+            write_row = writer.writerow
+
+        async with db.acquire_read(user_id) as conn:
+            async with conn.transaction(readonly=True, isolation="repeatable_read"):
+                async for record in conn.cursor(query, *params, prefetch=config.EXPORT_CHUNK_SIZE):
+                    write_row([_cell(v) for v in record.values()])
+                    rows += 1
+
+        if fmt == "xlsx":
+            await asyncio.to_thread(workbook.save, spool)
+        spool.flush()
+        return spool, rows
+    except BaseException:
+        spool.close()
+        raise
+
+
+async def from_bot_admin(message: Message) -> bool:
+    # Фильтром, а не проверкой внутри: у остальных /export уходит дальше по роутерам
+    return await is_bot_admin(message.from_user.id)
+
+
+@router.message(F.text.startswith("/export"), from_bot_admin)
+async def cmd_export(message: Message, bot: Bot):
+    user = message.from_user
+    if message.chat.type != "private":
+        # Персональные данные — только в личку
+        await message.answer("📄 /export работает только в личных сообщениях с ботом")
+        return
+
+    parsed = parse_filters(message.text)
+    if not parsed:
+        await message.answer(USAGE)
+        return
+    where, params, fmt = parsed
+    if fmt == "xlsx" and Workbook is None:
+        await message.answer("XLSX недоступен на сервере (нет openpyxl), используйте format=csv")
+        return
+
+    log_action("Запущен /export", user, handler="cmd_export", extra=message.text)
+    try:
+        spool, rows = await write_export(where, params, fmt, user.id)
+    except Exception as e:
+        log_action("Ошибка /export", user, handler="cmd_export", extra=str(e), level="ERROR")
+        await message.answer(f"❌ Ошибка выгрузки: {e}")
+        return
+
+    with spool:
+        size = spool.seek(0, 2)
+        if size > MAX_DOCUMENT_SIZE:
+            await message.answer(f"❌ Файл {size // (1024 * 1024)} МБ больше лимита Telegram 50 МБ — сузьте фильтр")
+            return
+        filename = f"users_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+        document = SpooledInputFile(spool, filename)
+        await outbound.scheduler.submit(
+            lambda: bot.send_document(user.id, document, caption=f"Строк: {rows}"),
+            chat_id=user.id,
+        )
+
+    await log_admin_action(user.id, f"/export {message.text[7:].strip()}".strip(), user.username)
+    log_action("Выгрузка отправлена", user, handler="cmd_export", extra=f"rows={rows}, bytes={size}")
@@ -11,7 +11,13 @@ from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 
+import config
 import db
+import deletions
+import outbound
+from joins import JoinAggregator
+from outbound import PRIORITY_MODERATION
+from usernames import resolver
 from utils import log_action
 from handlers.admin_logger import log_admin_action
 
@@ -29,6 +35,46 @@ SUPER_ADMIN_ID = int(os.getenv("SUPER_ADMIN_ID"))
 ROOT_ID = int(os.getenv("ROOT_ID"))
 
 # ====================== Событие входа пользователя ======================
+# Один запрос: ищем пользователя в student_roster (handlers/roster.py) по telegram_id
+# или username и создаём/сбрасываем запись в users. Нашёлся — анкета из списка
+# и is_verified = TRUE, иначе всё как раньше: пустая анкета и регистрация.
+JOIN_SQL = """
+    WITH listed AS (
+        SELECT stud_number, full_name, group_number, faculty
+        FROM student_roster
+        WHERE (telegram_id = $1 OR (telegram_id IS NULL AND lower(username) = lower($2::text)))
+          AND (claimed_by IS NULL OR claimed_by = $1)
+        ORDER BY telegram_id IS NULL, imported_at DESC
+        LIMIT 1
+    ),
+    claimed AS (
+        UPDATE student_roster r SET claimed_by = $1
+        FROM listed WHERE r.stud_number = listed.stud_number
+    )
+    INSERT INTO users (
+        telegram_id, username, is_verified, group_id,
+        full_name, group_number, faculty, stud_number, scholarship, created_at
+    )
+    SELECT $1, $2, listed.stud_number IS NOT NULL, $3,
+           listed.full_name, listed.group_number, listed.faculty, listed.stud_number, FALSE, $4
+    FROM (SELECT 1) AS one LEFT JOIN listed ON TRUE
+    ON CONFLICT (telegram_id) DO UPDATE
+    SET 
+        username     = EXCLUDED.username,
+        is_verified  = EXCLUDED.is_verified,
+        group_id     = EXCLUDED.group_id,
+        full_name    = EXCLUDED.full_name,
+        group_number = EXCLUDED.group_number,
+        faculty      = EXCLUDED.faculty,
+        mobile_number= NULL,
+        stud_number  = EXCLUDED.stud_number,
+        form_educ    = NULL,
+        scholarship  = FALSE,
+        updated_at   = $4
+    RETURNING is_verified
+"""
+
+
 @router.chat_member(ChatMemberUpdatedFilter(member_status_changed=(IS_NOT_MEMBER >> IS_MEMBER)))
 async def on_user_join(event: ChatMemberUpdated, bot: Bot):
     user = event.new_chat_member.user
@@ -41,49 +87,64 @@ async def on_user_join(event: ChatMemberUpdated, bot: Bot):
         extra=f"chat_id={chat_id}"
     )
 
+    if join_storm.note_join(chat_id):
+        # Наплыв: мут сразу, запись в БД и приветствие — общей пачкой (joins.py)
+        db.set_verified_cached(user.id, False)
+        await restrict_new_member(bot, chat_id, user.id)
+        join_storm.add(bot, chat_id, user)
+        return
+
     now_minsk = datetime.now(minsk_tz).replace(tzinfo=None)
 
-    async with db.get_pool().acquire() as conn:
-        await conn.execute("""
-            INSERT INTO users (telegram_id, username, is_verified, group_id, scholarship, created_at)
-            VALUES ($1, $2, FALSE, $3, FALSE, $4)
-            ON CONFLICT (telegram_id) DO UPDATE
-            SET 
-                username     = EXCLUDED.username,
-                is_verified  = FALSE,
-                group_id     = EXCLUDED.group_id,
-                full_name    = NULL,
-                group_number = NULL,
-                faculty      = NULL,
-                mobile_number= NULL,
-                stud_number  = NULL,
-                form_educ    = NULL,
-                scholarship  = FALSE,
-                updated_at   = $4
-        """, user.id, user.username, chat_id, now_minsk)
+    async with db.acquire() as conn:
+        listed = await conn.fetchval(JOIN_SQL, user.id, user.username, chat_id, now_minsk)
+    db.set_verified_cached(user.id, listed)
+
+    if listed:
+        # Есть в загруженном списке студентов — анкета уже заполнена, мут не нужен
+        log_action("Пользователь найден в списке студентов", user, handler="group_join", extra=f"chat_id={chat_id}")
+        outbound.scheduler.submit(
+            lambda: event.answer(
+                f"👋 {user.mention_html()} добро пожаловать! Ты есть в списке студентов — регистрация не нужна.",
+                parse_mode="HTML"
+            ),
+            chat_id=chat_id,
+        )
+        return
 
     # Ограничение прав пользователя до регистрации
-    await bot.restrict_chat_member(
+    await restrict_new_member(bot, chat_id, user.id)
+
+    # Приветствие — в общую очередь, хендлер его не ждёт
+    outbound.scheduler.submit(
+        lambda: event.answer(
+            f"👋 {user.mention_html()} добро пожаловать!\n\n"
+            "Чтобы получить возможность писать в чате — пройди регистрацию в личных сообщениях у бота.\n"
+            "Просто напиши ему /start",
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        ),
         chat_id=chat_id,
-        user_id=user.id,
-        permissions=ChatPermissions(
-            can_send_messages=False,
-            can_send_media_messages=False,
-            can_send_polls=False,
-            can_send_other_messages=False,
-            can_add_web_page_previews=False,
-            can_change_info=False,
-            can_invite_users=False,
-            can_pin_messages=False,
-        )
     )
 
-    await event.answer(
-        f"👋 {user.mention_html()} добро пожаловать!\n\n"
-        "Чтобы получить возможность писать в чате — пройди регистрацию в личных сообщениях у бота.\n"
-        "Просто напиши ему /start",
-        reply_markup=keyboard,
-        parse_mode="HTML"
+
+NEW_MEMBER_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_media_messages=False,
+    can_send_polls=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False,
+    can_change_info=False,
+    can_invite_users=False,
+    can_pin_messages=False,
+)
+
+
+async def restrict_new_member(bot: Bot, chat_id: int, user_id: int):
+    await outbound.scheduler.submit(
+        lambda: bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=NEW_MEMBER_PERMISSIONS),
+        chat_id=chat_id,
+        priority=PRIORITY_MODERATION,
     )
 
 
@@ -91,20 +152,13 @@ async def on_user_join(event: ChatMemberUpdated, bot: Bot):
 async def is_bot_admin(user_id: int) -> bool:
     if user_id == SUPER_ADMIN_ID:
         return True
-    async with db.get_pool().acquire() as conn:
-        return await conn.fetchval(
-            "SELECT TRUE FROM bot_admins WHERE telegram_id = $1",
-            user_id
-        ) is True
+    return db.is_bot_admin_cached(user_id)
 
 
 async def send_temp_message(message: Message, text: str, delay: int = 15):
-    msg = await message.answer(text)
-    await asyncio.sleep(delay)
-    try:
-        await msg.delete()
-    except:
-        pass
+    """Отвечает и сразу возвращается — удаление через delay сек делает deletions.scheduler"""
+    msg = await outbound.scheduler.submit(lambda: message.answer(text), chat_id=message.chat.id)
+    deletions.scheduler.schedule(msg.chat.id, msg.message_id, delay)
 
 
 async def admin_only(message: Message) -> bool:
@@ -120,6 +174,11 @@ async def admin_only(message: Message) -> bool:
 
 
 # ====================== Утилита ======================
+async def moderate(factory, chat_id: int):
+    """Вызов модерации через общую очередь Bot API с наивысшим приоритетом"""
+    return await outbound.scheduler.submit(factory, chat_id=chat_id, priority=PRIORITY_MODERATION)
+
+
 async def get_target_username(user) -> str:
     if user.username:
         return f"@{user.username}"
@@ -127,108 +186,157 @@ async def get_target_username(user) -> str:
 
 
 # ====================== Команды админа ======================
-@router.message(F.text.startswith("/kick"))
-async def cmd_kick(message: Message, bot: Bot):
+# /kick, /mute, /pmute, /unmute и /up принимают сразу несколько целей:
+# /mute @a @b @c или ответом на сообщение + список @username.
+
+UNMUTE_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_invite_users=True,
+    can_pin_messages=False
+)
+
+# Пакетный режим входов при наплыве (см. on_user_join)
+join_storm = JoinAggregator(keyboard, UNMUTE_PERMISSIONS)
+
+
+async def get_targets(message: Message):
+    """
+    Возвращает ([(telegram_id, username), ...], [не найденные @username]) или None.
+    Все @username ищутся одним запросом.
+    """
+    targets = []
+    if message.reply_to_message:
+        u = message.reply_to_message.from_user
+        targets.append((u.id, u.username or f"{u.first_name} {u.last_name or ''}".strip()))
+
+    usernames = [p[1:] for p in message.text.strip().split()[1:] if p.startswith("@") and len(p) > 1]
+    if not targets and not usernames:
+        await send_temp_message(
+            message,
+            "Использование команды:\n"
+            "— ответом на сообщение пользователя\n"
+            "— или: /команда @username [@username ...]"
+        )
+        return None
+
+    found = await resolver.resolve_many(usernames) if usernames else {}
+    not_found = []
+    seen = {t[0] for t in targets}
+    for username in usernames:
+        target = found.get(username.lower())
+        if not target:
+            not_found.append(username)
+        elif target[0] not in seen:
+            seen.add(target[0])
+            targets.append(target)
+    return targets, not_found
+
+
+async def run_moderation(message: Message, command: str, action, done_text: str, fail_text: str, prepare=None):
+    """
+    Применяет action(target_id) ко всем целям параллельно (не больше MODERATION_CONCURRENCY),
+    пишет одну запись в admin_action_logs и отвечает одной сводкой.
+    prepare(targets) — необязательный шаг над всеми целями сразу, до action.
+    """
     if not await is_bot_admin(message.from_user.id):
         await send_temp_message(message, "⛔ У вас нет прав")
         return
-    user = message.from_user
-    target = await get_target_by_username(message)
-    if not target: return
-    target_id, target_username = target
-    try:
-        await bot.ban_chat_member(message.chat.id, target_id)
-        await bot.unban_chat_member(message.chat.id, target_id)
-        await log_admin_action("/kick", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
-        await send_temp_message(message, f"👢 @{target_username} кикнут")
-    except Exception as e:
-        print("Kick error:", e)
-        await send_temp_message(message, f"❌ Не удалось кикнуть @{target_username}")
-    log_action("Использована команда /kick", user)
+    result = await get_targets(message)
+    if not result:
+        return
+    targets, not_found = result
+    if targets and prepare:
+        await prepare(targets)
+
+    semaphore = asyncio.Semaphore(config.MODERATION_CONCURRENCY)
+
+    async def apply(target_id: int, target_username: str) -> bool:
+        async with semaphore:
+            try:
+                await action(target_id)
+                return True
+            except Exception as e:
+                log_action(f"Ошибка {command}", message.from_user, extra=f"target={target_username}: {e}", level="WARNING")
+                return False
+
+    results = await asyncio.gather(*(apply(t_id, t_name) for t_id, t_name in targets))
+    done = [t for t, ok in zip(targets, results) if ok]
+    failed = [t for t, ok in zip(targets, results) if not ok]
+
+    if done:
+        await log_admin_action(
+            message.from_user.id,
+            command,
+            message.from_user.username,
+            done[0][0] if len(done) == 1 else None,
+            ", ".join(f"@{name}" for _, name in done),
+            message.chat.id,
+        )
 
+    lines = []
+    if done:
+        lines.append(f"{done_text}: " + ", ".join(f"@{name}" for _, name in done))
+    if failed:
+        lines.append(f"❌ {fail_text}: " + ", ".join(f"@{name}" for _, name in failed))
+    if not_found:
+        lines.append("Не найдены в базе: " + ", ".join(f"@{name}" for name in not_found))
+    if lines:
+        await send_temp_message(message, "\n".join(lines))
+    log_action(f"Использована команда {command}", message.from_user, extra=f"targets={len(targets)}")
 
-@router.message(F.text.startswith("/mute"))
-async def cmd_mute(message: Message, bot: Bot):
-    if not await is_bot_admin(message.from_user.id):
-        await send_temp_message(message, "⛔ У вас нет прав для использования этой команды")
-        return
 
-    target = await get_target_by_username(message)
-    if not target:
-        return
+@router.message(F.text.startswith("/kick"))
+async def cmd_kick(message: Message, bot: Bot):
+    chat_id = message.chat.id
 
-    target_id, target_username = target
+    async def kick(target_id: int):
+        await moderate(lambda: bot.ban_chat_member(chat_id, target_id), chat_id)
+        await moderate(lambda: bot.unban_chat_member(chat_id, target_id), chat_id)
+
+    await run_moderation(message, "/kick", kick, "👢 Кикнуты", "Не удалось кикнуть")
+
+
+@router.message(F.text.startswith("/mute"))
+async def cmd_mute(message: Message, bot: Bot):
+    chat_id = message.chat.id
     until = datetime.utcnow() + timedelta(hours=24)
     permissions = ChatPermissions(can_send_messages=False)
-    try:
-        await bot.restrict_chat_member(message.chat.id, target_id, permissions=permissions, until_date=until)
-        await log_admin_action("/mute", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
-        await send_temp_message(message, f"🔇 @{target_username} замучен на 24 часа")
-    except Exception as e:
-        print("Mute error:", e)
-        await send_temp_message(message, f"❌ Не удалось замутить @{target_username}")
-    user = message.from_user
-    log_action("Использована команда /mute", user)
+
+    async def mute(target_id: int):
+        await moderate(lambda: bot.restrict_chat_member(chat_id, target_id, permissions=permissions, until_date=until), chat_id)
+
+    await run_moderation(message, "/mute", mute, "🔇 Замучены на 24 часа", "Не удалось замутить")
 
 
 @router.message(F.text.startswith("/pmute"))
 async def cmd_pmute(message: Message, bot: Bot):
-    if not await is_bot_admin(message.from_user.id):
-        await send_temp_message(message, "⛔ У вас нет прав")
-        return
-    target = await get_target_by_username(message)
-    if not target: return
-    target_id, target_username = target
+    chat_id = message.chat.id
     permissions = ChatPermissions(can_send_messages=False)
-    try:
-        await bot.restrict_chat_member(message.chat.id, target_id, permissions=permissions)
-        await log_admin_action("/pmute", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
-        await send_temp_message(message, f"🔇 @{target_username} замучен навсегда")
-    except Exception as e:
-        print("Pmute error:", e)
-        await send_temp_message(message, f"❌ Не удалось замутить @{target_username}")
-    user = message.from_user
-    log_action("Использована команда /pmute", user)
+
+    async def pmute(target_id: int):
+        await moderate(lambda: bot.restrict_chat_member(chat_id, target_id, permissions=permissions), chat_id)
+
+    await run_moderation(message, "/pmute", pmute, "🔇 Замучены навсегда", "Не удалось замутить")
+
 
 @router.message(F.text.startswith("/unmute"))
 async def cmd_unmute(message: Message, bot: Bot):
-    if not await is_bot_admin(message.from_user.id):
-        await send_temp_message(message, "⛔ У вас нет прав")
-        return
-    target = await get_target_by_username(message)
-    if not target: return
-    target_id, target_username = target
-    permissions = ChatPermissions(
-        can_send_messages=True,
-        can_send_media_messages=True,
-        can_send_polls=True,
-        can_send_other_messages=True,
-        can_add_web_page_previews=True,
-        can_invite_users=True,
-        can_pin_messages=False
-    )
-    try:
-        await bot.restrict_chat_member(message.chat.id, target_id, permissions=permissions)
-        await log_admin_action("/unmute", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
-        await send_temp_message(message, f"🔊 @{target_username} размучен")
-    except Exception as e:
-        print("Unmute error:", e)
-        await send_temp_message(message, f"❌ Не удалось размучить @{target_username}")
-    user = message.from_user
-    log_action("Использована команда /unmute", user)
+    chat_id = message.chat.id
+
+    async def unmute(target_id: int):
+        await moderate(lambda: bot.restrict_chat_member(chat_id, target_id, permissions=UNMUTE_PERMISSIONS), chat_id)
+
+    await run_moderation(message, "/unmute", unmute, "🔊 Размучены", "Не удалось размутить")
 
 
-# ====================== /up @username ======================
+# ====================== /up @username [@username ...] ======================
 @router.message(F.text.startswith("/up"))
 async def cmd_up(message: Message, bot: Bot):
-    if not await is_bot_admin(message.from_user.id):
-        await send_temp_message(message, "⛔ У вас нет прав")
-        return
-    target = await get_target_by_username(message)
-    if not target: return
-    target_id, target_username = target
-    async with db.pool.acquire() as conn:
-        await conn.execute("UPDATE users SET is_verified = TRUE, verified_at = NOW() WHERE telegram_id = $1", target_id)
+    chat_id = message.chat.id
     permissions = ChatPermissions(
         can_send_messages=True,
         can_send_media_messages=True,
@@ -237,13 +345,23 @@ async def cmd_up(message: Message, bot: Bot):
         can_add_web_page_previews=True,
         can_invite_users=True
     )
-    try:
-        await bot.restrict_chat_member(message.chat.id, target_id, permissions=permissions)
-    except: pass
-    await log_admin_action("/up", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
-    await send_temp_message(message, f"✅ @{target_username} получил права")
-    user = message.from_user
-    log_action("Использована команда /up", user)
+
+    async def verify_all(targets):
+        # Верификация всех целей — одним UPDATE до размута
+        ids = [t[0] for t in targets]
+        rows = await db.fetch(
+            "UPDATE users SET is_verified = TRUE, verified_at = NOW() "
+            "WHERE telegram_id = ANY($1::bigint[]) RETURNING telegram_id",
+            ids
+        )
+        # Кэшируем только тех, у кого есть запись в users
+        for row in rows:
+            db.set_verified_cached(row["telegram_id"], True)
+
+    async def up(target_id: int):
+        await moderate(lambda: bot.restrict_chat_member(chat_id, target_id, permissions=permissions), chat_id)
+
+    await run_moderation(message, "/up", up, "✅ Получили права", "Не удалось выдать права в чате", prepare=verify_all)
 
 
 # ====================== /addadmin @username  ======================
@@ -252,12 +370,11 @@ async def cmd_addadmin(message: Message):
     if message.from_user.id != SUPER_ADMIN_ID:
         await send_temp_message(message, "⛔ Только супер-админ")
         return
-    target = await get_target_by_username(message)
+    target = await get_target(message)
     if not target: return
     target_id, target_username = target
-    async with db.get_pool().acquire() as conn:
-        await conn.execute("INSERT INTO bot_admins (telegram_id) VALUES ($1) ON CONFLICT DO NOTHING", target_id)
-    await log_admin_action("/addadmin", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
+    await db.add_bot_admin(target_id)
+    await log_admin_action(message.from_user.id, "/addadmin", message.from_user.username, target_id, target_username, message.chat.id)
     await send_temp_message(message, f"✅ @{target_username} добавлен в админы бота")
     user = message.from_user
     log_action("Использована команда /addadmin", user)
@@ -268,12 +385,11 @@ async def cmd_deladmin(message: Message):
     if message.from_user.id != SUPER_ADMIN_ID:
         await send_temp_message(message, "⛔ Только супер-админ")
         return
-    target = await get_target_by_username(message)
+    target = await get_target(message)
     if not target: return
     target_id, target_username = target
-    async with db.get_pool().acquire() as conn:
-        await conn.execute("DELETE FROM bot_admins WHERE telegram_id = $1", target_id)
-    await log_admin_action("/deladmin", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
+    await db.remove_bot_admin(target_id)
+    await log_admin_action(message.from_user.id, "/deladmin", message.from_user.username, target_id, target_username, message.chat.id)
     await send_temp_message(message, f"🗑 @{target_username} удалён из админов бота")
     user = message.from_user
     log_action("Использована команда /deladmin", user)
@@ -304,13 +420,7 @@ async def cmd_help(message: Message):
         return
 
     # Админ бота
-    async with db.get_pool().acquire() as conn:
-        is_admin = await conn.fetchval(
-            "SELECT TRUE FROM bot_admins WHERE telegram_id = $1",
-            user_id
-        )
-
-    if is_admin:
+    if db.is_bot_admin_cached(user_id):
         help_text = (
             "🛠 Команды бота (админ):\n"
             "/kick — кикнуть пользователя\n"
@@ -324,43 +434,17 @@ async def cmd_help(message: Message):
     user = message.from_user
     log_action("Использована команда /help", user)
 
-async def get_target_by_username(message: Message):
-    """
-    Получаем цель команды через @username в сообщении.
-    Возвращает (telegram_id, username) или None.
-    """
-    parts = message.text.strip().split()
-    if len(parts) != 2 or not parts[1].startswith("@"):
-        await send_temp_message(message, "Использование: /команда @username")
-        return None
-
-    username = parts[1][1:]  # убираем @
-    async with db.get_pool().acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT telegram_id, username FROM users WHERE username = $1",
-            username
-        )
-
-    if not row:
-        await send_temp_message(message, f"Пользователь @{username} не найден в базе")
-        return None
-
-    return row["telegram_id"], row["username"]
-
-
 async def get_target(message: Message):
     """
-    Возвращает (telegram_id, username) цели.
-    username может быть None.
+    Возвращает (telegram_id, username) цели или None.
     Поддержка:
     - reply на сообщение
-    - /command @username
+    - /команда @username (без учёта регистра, через usernames.resolver)
     """
     # Через reply
     if message.reply_to_message:
         u = message.reply_to_message.from_user
-        username = u.username or f"{u.first_name} {u.last_name or ''}".strip()
-        return u.id, username
+        return u.id, u.username or f"{u.first_name} {u.last_name or ''}".strip()
 
     # Через аргумент
     parts = message.text.strip().split()
@@ -374,104 +458,12 @@ async def get_target(message: Message):
         return None
 
     username = parts[1][1:]  # убираем @
-    async with db.get_pool().acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT telegram_id, username FROM users WHERE username = $1",
-            username
-        )
-
-    if not row:
-        await send_temp_message(message, f"Пользователь @{username} не найден в базе")
-        return None
-
-    return row["telegram_id"], row["username"] or username  # если в базе нет username, используем введённый
-
-
-async def get_user_by_username(username: str):
-    async with db.get_pool().acquire() as conn:
-        return await conn.fetchrow(
-            "SELECT telegram_id, username FROM users WHERE username = $1",
-            username
-        )
-
-async def get_target_username_only(message: Message):
-    parts = message.text.strip().split()
-    if len(parts) != 2 or not parts[1].startswith("@"):
-        await message.answer("Использование: /команда @username")
-        return None
-    username = parts[1][1:]
-    user = await db.pool.fetchrow("SELECT telegram_id, username FROM users WHERE username = $1", username)
-    if not user:
-        await message.answer(f"Пользователь @{username} не найден в базе")
-        return None
-    return user["telegram_id"], user["username"]
-
-async def log_admin_action(action, admin_id, admin_username, target_id=None, target_username=None, chat_id=None):
-    async with db.pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO admin_action_logs
-            (action, admin_telegram_id, admin_username, target_telegram_id, target_username, chat_id, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, NOW())
-            """,
-            action, admin_id, admin_username, target_id, target_username, chat_id
-        )
-
-async def get_target_reply_or_username(message: Message):
-    if message.reply_to_message:
-        u = message.reply_to_message.from_user
-        return u.id, u.username
-
-    parts = message.text.strip().split()
-    if len(parts) != 2 or not parts[1].startswith("@"):
-        await message.answer(
-            "Использование:\n— ответом на сообщение\n— или: /команда @username"
-        )
-        return None
-
-    username = parts[1][1:]
-    user = await db.pool.fetchrow("SELECT telegram_id, username FROM users WHERE username = $1", username)
-    if not user:
-        await message.answer(f"Пользователь @{username} не найден в базе")
-        return None
-    return user["telegram_id"], user["username"]
-
-async def get_target_user(message: Message):
-    """
-    Возвращает (telegram_id, username) или None
-    Поддержка:
-    - ответом
-    - /cmd @username
-    """
-    # 1️⃣ Через reply
-    if message.reply_to_message:
-        u = message.reply_to_message.from_user
-        return u.id, u.username
-
-    # 2️⃣ Через аргумент
-    parts = message.text.strip().split()
-    if len(parts) != 2 or not parts[1].startswith("@"):
-        await send_temp_message(
-            message,
-            "Использование команды:\n"
-            "— ответом на сообщение пользователя\n"
-            "— или: /команда @username"
-        )
-        return None
-
-    username = parts[1][1:]
-
-    async with db.get_pool().acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT telegram_id, username FROM users WHERE username = $1",
-            username
-        )
-
-    if not row:
+    target = await resolver.resolve(username)
+    if not target:
         await send_temp_message(message, f"Пользователь @{username} не найден в базе")
         return None
 
-    return row["telegram_id"], row["username"]
+    return target
 
 
 # ====================== /addadmin @username  ======================
@@ -485,18 +477,14 @@ async def cmd_addadmin(message: Message):
         await send_temp_message(message, "⛔ Только супер-админ может добавлять админов")
         return
 
-    target = await get_target_user(message)
+    target = await get_target(message)
     if not target:
         return
     target_id, target_username = target
 
-    async with db.get_pool().acquire() as conn:
-        await conn.execute(
-            "INSERT INTO bot_admins (telegram_id) VALUES ($1) ON CONFLICT DO NOTHING",
-            target_id
-        )
+    await db.add_bot_admin(target_id)
 
-    await log_admin_action("/addadmin", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
+    await log_admin_action(message.from_user.id, "/addadmin", message.from_user.username, target_id, target_username, message.chat.id)
     await send_temp_message(message, f"✅ @{target_username} добавлен в админы бота")
 
 
@@ -511,16 +499,12 @@ async def cmd_deladmin(message: Message):
         await send_temp_message(message, "⛔ Только супер-админ может удалять админов")
         return
 
-    target = await get_target_user(message)
+    target = await get_target(message)
     if not target:
         return
     target_id, target_username = target
 
-    async with db.get_pool().acquire() as conn:
-        await conn.execute(
-            "DELETE FROM bot_admins WHERE telegram_id = $1",
-            target_id
-        )
+    await db.remove_bot_admin(target_id)
 
-    await log_admin_action("/deladmin", message.from_user.id, message.from_user.username, target_id, target_username, message.chat.id)
+    await log_admin_action(message.from_user.id, "/deladmin", message.from_user.username, target_id, target_username, message.chat.id)
     await send_temp_message(message, f"🗑 @{target_username} удалён из админов бота")
\ No newline at end of file
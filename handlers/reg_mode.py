@@ -1,16 +1,35 @@
 # reg_mode.py
+import asyncio
+
 from aiogram import Router, F, Bot
 from aiogram.types import Message, ChatPermissions
 from utils import log_action
 import db
 import config
+import deletions
+import metrics
+import outbound
+from cache import TTLCache
+from outbound import PRIORITY_MODERATION, PRIORITY_WARNING
 from handlers.admin_logger import log_admin_action
+from pool_control import PoolSaturated
 
 router = Router(name="reg_mode")
 
 # 🔴 глобальный флаг
 REG_MODE_ENABLED = False
 
+# chat_id -> фоновая зачистка неверифицированных
+_sweeps: dict[int, asyncio.Task] = {}
+
+# (chat_id, user_id) -> предупреждение уже отправлено в очередь. Пока мут недавно
+# замученных доходит до Telegram, их следующие сообщения только удаляем
+_muted = TTLCache(config.MUTED_TRACKER_SIZE, config.MUTED_TRACKER_TTL)
+# user_id -> когда замученного последний раз проверяли в БД мимо кэша верификации
+_rechecked = TTLCache(config.MUTED_TRACKER_SIZE, config.MUTED_RECHECK_INTERVAL)
+# Сколько вызовов сэкономлено на повторных сообщениях
+_saved = {"messages": 0, "lookups": 0, "restricts": 0, "upserts": 0, "warnings": 0}
+
 def is_super_admin(user_id: int) -> bool:
     return user_id == config.SUPER_ADMIN_ID
 
@@ -18,7 +37,7 @@ def is_super_admin(user_id: int) -> bool:
 # /reg_mode on|off
 # =====================
 @router.message(F.text.startswith("/reg_mode"))
-async def cmd_reg_mode(message: Message):
+async def cmd_reg_mode(message: Message, bot: Bot):
     global REG_MODE_ENABLED
 
     if message.chat.type not in ("group", "supergroup"):
@@ -52,6 +71,113 @@ async def cmd_reg_mode(message: Message):
         chat_id=message.chat.id
     )
 
+    if REG_MODE_ENABLED:
+        start_sweep(bot, message.chat.id)
+    else:
+        stop_sweeps()
+        _muted.clear()
+
+
+# =====================
+# ЗАЧИСТКА при включении — мутим неверифицированных заранее
+# =====================
+def start_sweep(bot: Bot, chat_id: int):
+    task = _sweeps.get(chat_id)
+    if task and not task.done():
+        return
+    task = asyncio.create_task(sweep_unverified(bot, chat_id))
+    _sweeps[chat_id] = task
+    task.add_done_callback(lambda t: _sweeps.pop(chat_id) if _sweeps.get(chat_id) is t else None)
+
+
+def stop_sweeps():
+    # Отменённая зачистка может ещё дописывать отчёт — новая запустится, не дожидаясь её
+    for task in _sweeps.values():
+        task.cancel()
+    _sweeps.clear()
+
+
+async def _report(bot: Bot, progress_msg: Message | None, text: str) -> Message | None:
+    """Прогресс супер-админу в личку: первое сообщение отправляем, дальше редактируем"""
+    try:
+        if progress_msg is None:
+            return await outbound.scheduler.submit(lambda: bot.send_message(config.SUPER_ADMIN_ID, text))
+        await outbound.scheduler.submit(
+            lambda: bot.edit_message_text(text, chat_id=config.SUPER_ADMIN_ID, message_id=progress_msg.message_id),
+            coalesce_key=("sweep_progress", progress_msg.message_id),
+        )
+    except Exception as e:
+        log_action("REG_MODE: не удалось отправить прогресс зачистки", extra=str(e), level="WARNING")
+    return progress_msg
+
+
+async def sweep_unverified(bot: Bot, chat_id: int):
+    """
+    Проходит по неверифицированным участникам чата из users пачками
+    (keyset-курсор по telegram_id) и мутит их через outbound.scheduler.
+    Соединение берётся только на чтение очередной пачки.
+    """
+    semaphore = asyncio.Semaphore(config.SWEEP_CONCURRENCY)
+    restricted = failed = 0
+    last_id = None
+
+    async def restrict(user_id: int):
+        nonlocal restricted, failed
+        async with semaphore:
+            try:
+                await outbound.scheduler.submit(
+                    lambda: bot.restrict_chat_member(
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        permissions=ChatPermissions(can_send_messages=False)
+                    ),
+                    chat_id=chat_id,
+                    priority=PRIORITY_MODERATION,
+                )
+                restricted += 1
+            except Exception:
+                # Админы чата, вышедшие из группы и т.п.
+                failed += 1
+
+    log_action("REG_MODE: зачистка начата", handler="sweep_unverified", extra=f"chat_id={chat_id}")
+    progress_msg = await _report(bot, None, f"🧹 Зачистка chat_id={chat_id} начата")
+    try:
+        while True:
+            rows = await db.fetch_read("""
+                SELECT telegram_id FROM users
+                WHERE group_id = $1
+                  AND is_verified = FALSE
+                  AND ($2::bigint IS NULL OR telegram_id > $2)
+                ORDER BY telegram_id
+                LIMIT $3
+            """, chat_id, last_id, config.SWEEP_CHUNK_SIZE)
+            if not rows:
+                break
+            last_id = rows[-1]["telegram_id"]
+
+            await asyncio.gather(*(
+                restrict(r["telegram_id"]) for r in rows
+                if not is_super_admin(r["telegram_id"]) and not db.is_bot_admin_cached(r["telegram_id"])
+            ))
+            progress_msg = await _report(
+                bot, progress_msg,
+                f"🧹 Зачистка chat_id={chat_id}: замучено {restricted}, ошибок {failed}…"
+            )
+    except asyncio.CancelledError:
+        await _report(bot, progress_msg, f"⏹ Зачистка chat_id={chat_id} остановлена: замучено {restricted}, ошибок {failed}")
+        raise
+    except Exception as e:
+        log_action("REG_MODE: ошибка зачистки", handler="sweep_unverified", extra=str(e), level="ERROR")
+        await _report(bot, progress_msg, f"❌ Зачистка chat_id={chat_id} прервана ошибкой: {e}")
+        return
+
+    log_action(
+        "REG_MODE: зачистка завершена",
+        handler="sweep_unverified",
+        extra=f"chat_id={chat_id}, restricted={restricted}, failed={failed}"
+    )
+    await _report(bot, progress_msg, f"✅ Зачистка chat_id={chat_id} завершена: замучено {restricted}, ошибок {failed}")
+
 # =====================
 # ЛОВУШКА СООБЩЕНИЙ — мут + запись/обновление group_id
 # =====================
@@ -70,7 +196,43 @@ async def reg_mode_guard(message: Message, bot: Bot):
     # Супер-админ и верифицированные — пропускаем
     if is_super_admin(user_id):
         return
-    if await db.is_user_verified(user_id):
+
+    warned = _muted.get((chat_id, user_id))
+    if warned is not None:
+        # Уже замучен и предупреждён: только удаляем. Верификацию берём из кэша —
+        # регистрация обновляет его сразу (db.set_verified_cached); если запись вытеснили
+        # или она истекла, спрашиваем БД, но не чаще раза в MUTED_RECHECK_INTERVAL на пользователя
+        looked_up = False
+        verified = None
+        if user_id in db.verified_cache:
+            verified = db.verified_cache.get(user_id)
+        elif user_id not in _rechecked:
+            _rechecked.set(user_id, True)
+            looked_up = True
+            try:
+                verified = await db.is_user_verified(user_id)
+            except PoolSaturated:
+                # Он и так замучен — удалить сообщение безопасно
+                verified = None
+        if verified:
+            _muted.pop((chat_id, user_id))
+            return
+        deletions.coalescer.delete(bot, chat_id, message.message_id)
+        _saved["messages"] += 1
+        _saved["lookups"] += not looked_up
+        _saved["restricts"] += 1
+        _saved["upserts"] += 1
+        # Пока прежнее предупреждение не ушло (или ещё не поставлено), новое схлопнулось бы с ним и так
+        _saved["warnings"] += warned and not outbound.scheduler.is_pending(("reg_warning", chat_id, user_id))
+        return
+
+    try:
+        if await db.is_user_verified(user_id):
+            return
+    except PoolSaturated as e:
+        # Статус неизвестен — лучше пропустить сообщение, чем замутить верифицированного
+        log_action("REG_MODE: БД перегружена, проверка пропущена", user=user, handler="reg_mode_guard",
+                   extra=str(e), level="WARNING")
         return
 
     log_action(
@@ -80,22 +242,27 @@ async def reg_mode_guard(message: Message, bot: Bot):
         extra=f"chat_id={chat_id}"
     )
 
-    # 1. Удаляем сообщение
-    try:
-        await message.delete()
-    except Exception as e:
-        log_action("REG_MODE: ошибка удаления сообщения", user, str(e), level="WARNING")
+    # 1. Удаляем сообщение — пачкой вместе с остальными из этого чата
+    deletions.coalescer.delete(bot, chat_id, message.message_id)
 
-    # 2. Мут + создание/обновление записи в БД
+    # 2. Мут + создание/обновление записи в БД.
+    # Отмечаем до ожидания мута: сообщения, пришедшие, пока он в очереди, только удаляются
+    _muted.set((chat_id, user_id), False)
+    restricted = False
     try:
-        await bot.restrict_chat_member(
+        await outbound.scheduler.submit(
+            lambda: bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                permissions=ChatPermissions(can_send_messages=False)
+            ),
             chat_id=chat_id,
-            user_id=user_id,
-            permissions=ChatPermissions(can_send_messages=False)
+            priority=PRIORITY_MODERATION,
         )
+        restricted = True
 
         # Записываем или обновляем запись в users
-        async with db.pool.acquire() as conn:
+        async with db.acquire() as conn:
             await conn.execute("""
                 INSERT INTO users (
                     telegram_id, 
@@ -111,6 +278,7 @@ async def reg_mode_guard(message: Message, bot: Bot):
                     group_id = EXCLUDED.group_id,
                     updated_at = NOW()
             """, user_id, user.username or None, chat_id)
+        db.pin_to_primary(user_id)
 
         log_action(
             action="REG_MODE: пользователь замучен + запись/обновление group_id",
@@ -127,13 +295,36 @@ async def reg_mode_guard(message: Message, bot: Bot):
             extra=str(e),
             level="ERROR"
         )
+    finally:
+        if not restricted:
+            # Мут не прошёл — следующее сообщение пусть попробует снова
+            _muted.pop((chat_id, user_id))
 
-    # 3. Сообщение пользователю
+    # 3. Сообщение пользователю. Пока предупреждение стоит в очереди,
+    # повторные сообщения того же пользователя нового не добавляют
     mention = f"@{user.username}" if user.username else user.full_name
-    try:
-        await bot.send_message(
+    outbound.scheduler.submit(
+        lambda: bot.send_message(
             chat_id,
             f"⛔ {mention}, чтобы писать в группе — пройди регистрацию:\n👉 @{config.BOT_USERNAME}"
-        )
-    except Exception as e:
-        log_action("REG_MODE: ошибка отправки сообщения", user, str(e), level="WARNING")
\ No newline at end of file
+        ),
+        chat_id=chat_id,
+        priority=PRIORITY_WARNING,
+        coalesce_key=("reg_warning", chat_id, user_id),
+    )
+    if (chat_id, user_id) in _muted:
+        _muted.set((chat_id, user_id), True)
+
+
+def muted_stats() -> dict:
+    return {"tracked": len(_muted), **{f"saved_{name}": value for name, value in _saved.items()}}
+
+
+def _muted_metrics():
+    return [
+        (f"bot_reg_mode_muted_{name}", "Повторные сообщения замученных в reg_mode_guard", {}, value)
+        for name, value in muted_stats().items()
+    ]
+
+
+metrics.register_collector(_muted_metrics)
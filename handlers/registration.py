@@ -19,6 +19,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import config
 import db
+import outbound
+from outbound import PRIORITY_MODERATION
 from utils import get_user_info, log_action, log_fsm
 
 router = Router(name="registration")
@@ -101,10 +103,14 @@ async def _try_unmute_user(bot: Bot, user_id: int, group_id: int | None, user_fo
             can_invite_users=True,
             can_pin_messages=False
         )
-        await bot.restrict_chat_member(
+        await outbound.scheduler.submit(
+            lambda: bot.restrict_chat_member(
+                chat_id=group_id,
+                user_id=user_id,
+                permissions=permissions
+            ),
             chat_id=group_id,
-            user_id=user_id,
-            permissions=permissions
+            priority=PRIORITY_MODERATION,
         )
         return "Права в группе восстановлены ✅"
         
@@ -132,15 +138,7 @@ async def cmd_start(message: Message, state: FSMContext):
     await log_fsm(state, user, None, "start command")
     await state.clear()
 
-    async with db.pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO users (telegram_id, username, is_verified)
-            VALUES ($1, $2, FALSE)
-            ON CONFLICT (telegram_id) DO UPDATE
-            SET username = EXCLUDED.username
-        """, user.id, user.username)
-
-    verified = await db.is_user_verified(user.id)
+    verified = await db.touch_user(user.id, user.username)
 
     log_action(
         action="Проверен статус верификации после /start",
@@ -292,47 +290,8 @@ async def process_scholarship(message: Message, state: FSMContext, bot: Bot):
     user_id = user.id
 
     try:
-        async with db.pool.acquire() as conn:
-            # Сохраняем данные, НЕ ТРОГАЕМ is_verified и group_id
-            await conn.execute("""
-                INSERT INTO users (
-                    telegram_id, username, full_name, group_number, faculty,
-                    mobile_number, stud_number, form_educ, scholarship,
-                    created_at, updated_at
-                )
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW(), NOW())
-                ON CONFLICT (telegram_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    full_name = EXCLUDED.full_name,
-                    group_number = EXCLUDED.group_number,
-                    faculty = EXCLUDED.faculty,
-                    mobile_number = EXCLUDED.mobile_number,
-                    stud_number = EXCLUDED.stud_number,
-                    form_educ = EXCLUDED.form_educ,
-                    scholarship = EXCLUDED.scholarship,
-                    updated_at = NOW()
-            """, 
-                user_id,
-                user.username or None,
-                data.get("full_name"),
-                data.get("group_number"),
-                data.get("faculty"),
-                data.get("mobile_number"),
-                data.get("stud_number"),
-                data.get("form_educ"),
-                data.get("scholarship")
-            )
-
-            # Явно ставим is_verified = TRUE
-            await conn.execute("""
-                UPDATE users
-                SET is_verified = TRUE,
-                    updated_at = NOW()
-                WHERE telegram_id = $1
-            """, user_id)
-
-            # Получаем group_id
-            group_id = await conn.fetchval("SELECT group_id FROM users WHERE telegram_id = $1", user_id)
+        # Анкета + is_verified = TRUE одним запросом, group_id не трогаем
+        group_id = await db.save_registration(user_id, user.username or None, data)
 
         log_action("Регистрация завершена успешно, is_verified = TRUE", user, handler="process_scholarship")
 
@@ -369,7 +328,7 @@ async def show_status(message: Message):
     user = message.from_user
     user_id = user.id
 
-    # Всегда свежий запрос
+    # Кэш обновляется при каждой смене is_verified
     verified = await db.is_user_verified(user_id)
 
     text = (
@@ -397,12 +356,12 @@ async def update_data(message: Message, state: FSMContext):
         await message.answer("Вы ещё не зарегистрированы. /reg чтобы начать")
         return
 
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT full_name, group_number, faculty, mobile_number,
-                   stud_number, form_educ, scholarship
-            FROM users WHERE telegram_id=$1
-        """, user_id)
+    # С реплики, но сразу после регистрации/правки — с primary (см. db.pin_to_primary)
+    row = await db.fetchrow_read("""
+        SELECT full_name, group_number, faculty, mobile_number,
+               stud_number, form_educ, scholarship
+        FROM users WHERE telegram_id=$1
+    """, user_id, user_id=user_id)
 
     if not row:
         await message.answer("Данные не найдены, начнём регистрацию заново.")
@@ -553,46 +512,8 @@ async def process_confirm_registration(callback: CallbackQuery, state: FSMContex
     chat_id = callback.message.chat.id if callback.message.chat.type in ("group", "supergroup") else None
 
     try:
-        async with db.pool.acquire() as conn:
-            # Сохраняем данные, НЕ ТРОГАЕМ is_verified и group_id
-            await conn.execute("""
-                INSERT INTO users (
-                    telegram_id, username, full_name, group_number, faculty,
-                    mobile_number, stud_number, form_educ, scholarship,
-                    created_at, updated_at
-                )
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW(), NOW())
-                ON CONFLICT (telegram_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    full_name = EXCLUDED.full_name,
-                    group_number = EXCLUDED.group_number,
-                    faculty = EXCLUDED.faculty,
-                    mobile_number = EXCLUDED.mobile_number,
-                    stud_number = EXCLUDED.stud_number,
-                    form_educ = EXCLUDED.form_educ,
-                    scholarship = EXCLUDED.scholarship,
-                    updated_at = NOW()
-            """, 
-                user_id,
-                user.username or None,
-                data.get("full_name"),
-                data.get("group_number"),
-                data.get("faculty"),
-                data.get("mobile_number"),
-                data.get("stud_number"),
-                data.get("form_educ"),
-                data.get("scholarship")
-            )
-
-            # Явно верифицируем
-            await conn.execute("""
-                UPDATE users
-                SET is_verified = TRUE,
-                    updated_at = NOW()
-                WHERE telegram_id = $1
-            """, user_id)
-
-            group_id = await conn.fetchval("SELECT group_id FROM users WHERE telegram_id = $1", user_id)
+        # Анкета + is_verified = TRUE одним запросом, group_id не трогаем
+        group_id = await db.save_registration(user_id, user.username or None, data)
 
         log_action("Редактирование завершено успешно, is_verified = TRUE", user, handler="process_confirm_registration")
 
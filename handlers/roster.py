@@ -0,0 +1,262 @@
+# roster.py
+import asyncio
+import csv
+import io
+import tempfile
+import time
+
+from aiogram import Router, F, Bot
+from aiogram.types import Message
+
+import config
+import db
+import outbound
+from handlers.admin_logger import log_admin_action
+from handlers.group import moderate, UNMUTE_PERMISSIONS
+from handlers.registration import FACULTIES, FACULTY_REVERSE
+from utils import log_action
+
+router = Router(name="roster")
+
+# Фоновые размуты после импорта (держим ссылки, чтобы задачи не собрал GC)
+_unmute_tasks: set[asyncio.Task] = set()
+
+# ====================== Список студентов ======================
+# Официальный список приходит до того, как студенты зайдут в группу.
+# Строка списка привязывается к Telegram по telegram_id или username (если они
+# есть в файле); on_user_join находит её тем же запросом, что создаёт пользователя,
+# и сразу верифицирует — без мута, лички и регистрации.
+
+TABLE_NAME = "student_roster"
+COLUMNS = ("stud_number", "full_name", "group_number", "faculty", "telegram_id", "username")
+
+# Заголовки CSV -> колонка
+HEADERS = {
+    "stud_number": "stud_number", "student_number": "stud_number", "студ. билет": "stud_number",
+    "студенческий": "stud_number", "номер студенческого": "stud_number",
+    "full_name": "full_name", "фио": "full_name",
+    "group_number": "group_number", "group": "group_number", "группа": "group_number",
+    "faculty": "faculty", "факультет": "faculty",
+    "telegram_id": "telegram_id", "username": "username",
+}
+
+MERGE_SQL = f"""
+    WITH staged AS (
+        SELECT DISTINCT ON (s.stud_number)
+            s.stud_number, s.full_name, s.group_number, s.faculty,
+            COALESCE(s.telegram_id, r.telegram_id) AS telegram_id,
+            COALESCE(s.username, r.username) AS username,
+            r.claimed_by
+        FROM roster_staging s
+        LEFT JOIN {TABLE_NAME} r USING (stud_number)
+        ORDER BY s.stud_number
+    ),
+    candidates AS (
+        -- Уже зашедшие и не прошедшие регистрацию. Строку, занятую другим, не трогаем;
+        -- по одному username — только если он однозначный и у строки нет telegram_id
+        SELECT DISTINCT ON (s.stud_number) s.stud_number, u.telegram_id
+        FROM staged s
+        JOIN users u ON NOT u.is_verified AND (
+            u.telegram_id = s.telegram_id
+            OR (
+                s.telegram_id IS NULL
+                AND lower(u.username) = lower(s.username)
+                AND NOT EXISTS (
+                    SELECT 1 FROM users o
+                    WHERE lower(o.username) = lower(s.username) AND o.telegram_id <> u.telegram_id
+                )
+            )
+        )
+        WHERE (s.claimed_by IS NULL OR s.claimed_by = u.telegram_id)
+          AND NOT EXISTS (
+            SELECT 1 FROM {TABLE_NAME} c
+            WHERE c.claimed_by = u.telegram_id AND c.stud_number <> s.stud_number
+          )
+        ORDER BY s.stud_number
+    ),
+    matched AS (
+        -- Один пользователь — одна строка списка
+        SELECT DISTINCT ON (telegram_id) stud_number, telegram_id
+        FROM candidates
+        ORDER BY telegram_id, stud_number
+    ),
+    upserted AS (
+        -- claimed_by — здесь же: вторая модификация той же строки в одном запросе не гарантирована
+        INSERT INTO {TABLE_NAME} ({", ".join(COLUMNS)}, claimed_by, imported_at)
+        SELECT {", ".join(f"s.{c}" for c in COLUMNS)}, m.telegram_id, NOW()
+        FROM staged s LEFT JOIN matched m USING (stud_number)
+        ON CONFLICT (stud_number) DO UPDATE SET
+            full_name = EXCLUDED.full_name,
+            group_number = EXCLUDED.group_number,
+            faculty = COALESCE(EXCLUDED.faculty, {TABLE_NAME}.faculty),
+            telegram_id = COALESCE(EXCLUDED.telegram_id, {TABLE_NAME}.telegram_id),
+            username = COALESCE(EXCLUDED.username, {TABLE_NAME}.username),
+            claimed_by = COALESCE({TABLE_NAME}.claimed_by, EXCLUDED.claimed_by),
+            imported_at = NOW()
+        RETURNING (xmax = 0) AS inserted
+    ),
+    verified AS (
+        -- Анкета из списка + верификация
+        UPDATE users u SET
+            full_name = s.full_name,
+            group_number = s.group_number,
+            faculty = COALESCE(s.faculty, u.faculty),
+            stud_number = s.stud_number,
+            is_verified = TRUE,
+            updated_at = NOW()
+        FROM matched m
+        JOIN staged s USING (stud_number)
+        WHERE u.telegram_id = m.telegram_id
+        RETURNING u.telegram_id, u.group_id
+    )
+    SELECT
+        (SELECT count(*) FROM upserted) AS total,
+        (SELECT count(*) FROM upserted WHERE inserted) AS inserted,
+        (SELECT COALESCE(array_agg(ARRAY[telegram_id, group_id]), '{{}}') FROM verified) AS verified
+"""
+
+
+async def setup():
+    try:
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                stud_number TEXT PRIMARY KEY,
+                full_name TEXT NOT NULL,
+                group_number TEXT,
+                faculty TEXT,
+                telegram_id BIGINT,
+                username TEXT,
+                claimed_by BIGINT,
+                imported_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        await db.execute(f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_telegram_id_idx ON {TABLE_NAME} (telegram_id)")
+        await db.execute(f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_username_idx ON {TABLE_NAME} (lower(username))")
+    except Exception as e:
+        log_action("Не удалось создать таблицу student_roster", extra=str(e), level="ERROR")
+
+
+def parse_roster(text_file) -> tuple[list[tuple], int]:
+    """CSV (разделитель , или ;) -> (записи в порядке COLUMNS, число пропущенных строк)"""
+    sample = text_file.read(4096)
+    text_file.seek(0)
+    dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    reader = csv.reader(text_file, dialect)
+    header = [HEADERS.get(h.strip().lower()) for h in next(reader, [])]
+    if "stud_number" not in header or "full_name" not in header:
+        raise ValueError("в заголовке нужны колонки stud_number (Студ. билет) и full_name (ФИО)")
+
+    records = []
+    skipped = 0
+    for row in reader:
+        values = {col: cell.strip() for col, cell in zip(header, row) if col and cell.strip()}
+        stud_number = values.get("stud_number")
+        full_name = values.get("full_name")
+        if not stud_number or not full_name:
+            skipped += 1
+            continue
+        faculty = values.get("faculty")
+        if faculty:
+            faculty = FACULTIES.get(faculty, faculty)
+            if faculty not in FACULTY_REVERSE:
+                faculty = None
+        telegram_id = values.get("telegram_id")
+        username = values.get("username")
+        records.append((
+            stud_number,
+            " ".join(full_name.split()),
+            values.get("group_number"),
+            faculty,
+            int(telegram_id) if telegram_id and telegram_id.lstrip("-").isdigit() else None,
+            username.lstrip("@") if username else None,
+        ))
+    return records, skipped
+
+
+async def import_roster(records: list[tuple]) -> tuple[int, int, list[tuple[int, int | None]]]:
+    """COPY во временную таблицу и одно слияние. -> (строк, новых, [(telegram_id, group_id) верифицированных])"""
+    async with db.acquire() as conn:
+        timeout = config.ROSTER_IMPORT_TIMEOUT
+        async with conn.transaction():
+            # Пул режет запросы на 10 с; большой COPY и слияние идут дольше — поднимаем лимит
+            # только для этой транзакции, и на сервере, и в клиенте
+            await conn.execute(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+            await conn.execute(f"""
+                CREATE TEMP TABLE roster_staging
+                (LIKE {TABLE_NAME} INCLUDING DEFAULTS) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table("roster_staging", records=records, columns=COLUMNS, timeout=timeout)
+            row = await conn.fetchrow(MERGE_SQL, timeout=timeout)
+    verified = [(int(user_id), group_id) for user_id, group_id in row["verified"]]
+    for user_id, _ in verified:
+        db.set_verified_cached(user_id, True)
+    return row["total"], row["inserted"], verified
+
+
+async def unmute_verified(bot: Bot, admin_id: int, verified: list[tuple[int, int | None]]):
+    """Снимает мут с верифицированных списком — в фоне, через общую очередь Bot API"""
+    semaphore = asyncio.Semaphore(config.MODERATION_CONCURRENCY)
+    done = failed = 0
+
+    async def unmute(user_id: int, group_id: int):
+        nonlocal done, failed
+        async with semaphore:
+            try:
+                await moderate(
+                    lambda: bot.restrict_chat_member(group_id, user_id, permissions=UNMUTE_PERMISSIONS),
+                    group_id,
+                )
+                done += 1
+            except Exception:
+                failed += 1
+
+    await asyncio.gather(*(unmute(u, g) for u, g in verified if g))
+    try:
+        await outbound.scheduler.submit(
+            lambda: bot.send_message(admin_id, f"🔊 Размучено по списку: {done}, ошибок: {failed}"),
+            chat_id=admin_id,
+        )
+    except Exception as e:
+        log_action("Не удалось отправить итог размута по списку", extra=str(e), level="WARNING")
+
+
+@router.message(F.document, F.caption.startswith("/import_roster"), F.chat.type == "private")
+async def cmd_import_roster(message: Message, bot: Bot):
+    user = message.from_user
+    if user.id != config.SUPER_ADMIN_ID:
+        await message.answer("⛔ Только супер админ может загружать список студентов")
+        return
+
+    start = time.perf_counter()
+    with tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_SIZE, mode="w+b") as spool:
+        await bot.download(message.document, destination=spool)
+        spool.seek(0)
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            records, skipped = parse_roster(text)
+        except (ValueError, csv.Error, UnicodeDecodeError) as e:
+            await message.answer(f"❌ Не удалось прочитать CSV: {e}")
+            return
+        finally:
+            text.detach()
+
+    try:
+        total, inserted, verified = await import_roster(records)
+    except Exception as e:
+        log_action("Ошибка импорта списка", user, handler="cmd_import_roster", extra=str(e), level="ERROR")
+        await message.answer(f"❌ Ошибка импорта: {e}")
+        return
+    elapsed = time.perf_counter() - start
+
+    await message.answer(
+        f"📋 Список загружен за {elapsed:.1f} с\n"
+        f"Строк: {total} (новых {inserted}, обновлено {total - inserted}, пропущено {skipped})\n"
+        f"Сразу верифицировано уже зашедших: {len(verified)}"
+    )
+    await log_admin_action(user.id, f"import_roster: rows={total}, verified={len(verified)}", user.username)
+    log_action("Импортирован список студентов", user, handler="cmd_import_roster",
+               extra=f"rows={total}, inserted={inserted}, skipped={skipped}, verified={len(verified)}, {elapsed:.2f}s")
+    if verified:
+        task = asyncio.create_task(unmute_verified(bot, user.id, verified))
+        _unmute_tasks.add(task)
+        task.add_done_callback(_unmute_tasks.discard)
@@ -0,0 +1,223 @@
+# joins.py
+import asyncio
+import collections
+import logging
+import time
+from datetime import datetime
+
+import pytz
+from aiogram import Bot
+from aiogram.types import ChatPermissions, InlineKeyboardMarkup, User
+
+import config
+import db
+import metrics
+import outbound
+from outbound import PRIORITY_MODERATION
+from pool_control import PoolSaturated
+from utils import log_action
+
+logger = logging.getLogger("joins")
+
+minsk_tz = pytz.timezone("Europe/Minsk")
+
+# Пачка входов одним запросом: то же, что JOIN_SQL в handlers/group.py, но через UNNEST
+BATCH_JOIN_SQL = """
+    WITH joined AS (
+        SELECT * FROM UNNEST($1::bigint[], $2::text[]) AS j(telegram_id, username)
+    ),
+    listed AS (
+        SELECT DISTINCT ON (j.telegram_id)
+            j.telegram_id, r.stud_number, r.full_name, r.group_number, r.faculty
+        FROM joined j
+        JOIN student_roster r
+          ON (r.telegram_id = j.telegram_id OR (r.telegram_id IS NULL AND lower(r.username) = lower(j.username)))
+         AND (r.claimed_by IS NULL OR r.claimed_by = j.telegram_id)
+        ORDER BY j.telegram_id, r.telegram_id IS NULL, r.imported_at DESC
+    ),
+    claimed AS (
+        UPDATE student_roster r SET claimed_by = l.telegram_id
+        FROM listed l WHERE r.stud_number = l.stud_number
+    )
+    INSERT INTO users (
+        telegram_id, username, is_verified, group_id,
+        full_name, group_number, faculty, stud_number, scholarship, created_at
+    )
+    SELECT j.telegram_id, j.username, l.stud_number IS NOT NULL, $3,
+           l.full_name, l.group_number, l.faculty, l.stud_number, FALSE, $4
+    FROM joined j LEFT JOIN listed l USING (telegram_id)
+    ON CONFLICT (telegram_id) DO UPDATE
+    SET
+        username     = EXCLUDED.username,
+        is_verified  = EXCLUDED.is_verified,
+        group_id     = EXCLUDED.group_id,
+        full_name    = EXCLUDED.full_name,
+        group_number = EXCLUDED.group_number,
+        faculty      = EXCLUDED.faculty,
+        mobile_number= NULL,
+        stud_number  = EXCLUDED.stud_number,
+        form_educ    = NULL,
+        scholarship  = FALSE,
+        updated_at   = $4
+    RETURNING telegram_id, is_verified
+"""
+
+
+class JoinAggregator:
+    """
+    Режим «наплыва» для входов в группу.
+
+    Пока в чате меньше JOIN_STORM_THRESHOLD входов за JOIN_STORM_RATE_WINDOW сек,
+    on_user_join работает как обычно. Выше порога вход только мутится сразу,
+    а запись в users и приветствие копятся по чату JOIN_BATCH_WINDOW сек
+    (или до JOIN_BATCH_MAX человек): один UNNEST-upsert и одно общее приветствие
+    на всех. Режим выключается, когда поток падает ниже половины порога.
+    """
+
+    def __init__(self, keyboard: InlineKeyboardMarkup, unmute_permissions: ChatPermissions):
+        self.keyboard = keyboard
+        self.unmute_permissions = unmute_permissions
+        self._recent: dict[int, collections.deque] = {}
+        self._storm: set[int] = set()
+        self._buffers: dict[int, dict[int, User]] = {}
+        self._bots: dict[int, Bot] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.batched = 0
+        self.batches = 0
+        self.failed = 0
+        metrics.register_collector(self._metrics)
+
+    # ---------- определение наплыва ----------
+    def note_join(self, chat_id: int) -> bool:
+        """Учитывает вход, True — чат сейчас в режиме наплыва"""
+        now = time.monotonic()
+        recent = self._recent.get(chat_id)
+        if recent is None:
+            recent = self._recent[chat_id] = collections.deque()
+        recent.append(now)
+        while recent and recent[0] < now - config.JOIN_STORM_RATE_WINDOW:
+            recent.popleft()
+
+        rate = len(recent)
+        if chat_id not in self._storm and rate >= config.JOIN_STORM_THRESHOLD:
+            self._storm.add(chat_id)
+            log_action("Наплыв входов: пакетный режим включён", handler="join_storm",
+                       extra=f"chat_id={chat_id}, joins={rate}/{config.JOIN_STORM_RATE_WINDOW}s")
+        elif chat_id in self._storm and rate < config.JOIN_STORM_THRESHOLD / 2:
+            self._storm.discard(chat_id)
+            log_action("Наплыв входов: пакетный режим выключен", handler="join_storm", extra=f"chat_id={chat_id}")
+        if not recent:
+            del self._recent[chat_id]
+        return chat_id in self._storm
+
+    # ---------- буфер ----------
+    def add(self, bot: Bot, chat_id: int, user: User):
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            buffer = self._buffers[chat_id] = {}
+            self._bots[chat_id] = bot
+            asyncio.get_running_loop().call_later(config.JOIN_BATCH_WINDOW, self._flush_soon, chat_id, buffer)
+        # Повторный вход того же человека в пачке — одна строка, иначе ON CONFLICT упадёт
+        buffer[user.id] = user
+        if len(buffer) >= config.JOIN_BATCH_MAX:
+            self._flush_soon(chat_id, buffer)
+
+    def _flush_soon(self, chat_id: int, buffer: dict[int, User]):
+        if self._buffers.get(chat_id) is not buffer:
+            # Эта пачка уже ушла по переполнению
+            return
+        del self._buffers[chat_id]
+        bot = self._bots.pop(chat_id)
+        task = asyncio.create_task(self._flush(bot, chat_id, list(buffer.values())))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, bot: Bot, chat_id: int, users: list[User]):
+        now_minsk = datetime.now(minsk_tz).replace(tzinfo=None)
+        try:
+            rows = await db.fetch(
+                BATCH_JOIN_SQL,
+                [u.id for u in users], [u.username for u in users], chat_id, now_minsk,
+            )
+        except Exception as e:
+            logger.error(f"Не удалось записать пачку входов chat_id={chat_id} ({len(users)} чел.): {e}, пишем по одному")
+            rows = await self._upsert_one_by_one(chat_id, users, now_minsk)
+        self.batches += 1
+        self.batched += len(users)
+
+        listed_ids = set()
+        for row in rows:
+            db.set_verified_cached(row["telegram_id"], row["is_verified"])
+            if row["is_verified"]:
+                listed_ids.add(row["telegram_id"])
+
+        listed = [u for u in users if u.id in listed_ids]
+        others = [u for u in users if u.id not in listed_ids]
+        for user in listed:
+            # Из списка студентов: мут, поставленный при входе, снимаем
+            outbound.scheduler.submit(
+                lambda user_id=user.id: bot.restrict_chat_member(chat_id, user_id, permissions=self.unmute_permissions),
+                chat_id=chat_id,
+                priority=PRIORITY_MODERATION,
+            )
+
+        # Приветствие с кнопкой — даже тем, кого не удалось записать: запись создаст регистрация
+        lines = []
+        if others:
+            lines.append(
+                "👋 Добро пожаловать: " + ", ".join(u.mention_html() for u in others) + "!\n\n"
+                "Чтобы писать в чате — пройдите регистрацию в личных сообщениях у бота: напишите ему /start"
+            )
+        if listed:
+            lines.append(
+                "✅ Есть в списке студентов, регистрация не нужна: " + ", ".join(u.mention_html() for u in listed)
+            )
+        outbound.scheduler.submit(
+            lambda: bot.send_message(
+                chat_id, "\n\n".join(lines),
+                reply_markup=self.keyboard if others else None,
+                parse_mode="HTML",
+            ),
+            chat_id=chat_id,
+        )
+        log_action("Наплыв входов: пачка записана", handler="join_storm",
+                   extra=f"chat_id={chat_id}, users={len(users)}, listed={len(listed)}")
+
+    async def _upsert_one_by_one(self, chat_id: int, users: list[User], now_minsk: datetime) -> list:
+        """Запасной путь: тот же запрос на каждого — одна плохая строка не топит всю пачку"""
+        rows = []
+        for i, user in enumerate(users):
+            try:
+                rows += await db.fetch(BATCH_JOIN_SQL, [user.id], [user.username], chat_id, now_minsk)
+            except PoolSaturated as e:
+                # БД перегружена — по одному тем более не успеем
+                self.failed += len(users) - i
+                logger.error(f"Входы chat_id={chat_id} не записаны: {e}")
+                break
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Не удалось записать вход user_id={user.id} chat_id={chat_id}: {e}")
+        return rows
+
+    async def stop(self):
+        for chat_id, buffer in list(self._buffers.items()):
+            self._flush_soon(chat_id, buffer)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "storm_chats": len(self._storm),
+            "batched_joins": self.batched,
+            "batches": self.batches,
+            # Не записаны в users (остались замучены, приветствие с кнопкой получили)
+            "failed_upserts": self.failed,
+            # Было бы по одному upsert и одному приветствию на каждый вход
+            "welcomes_saved": self.batched - self.batches,
+        }
+
+    def _metrics(self):
+        return [
+            (f"bot_join_storm_{name}", "Пакетная обработка входов", {}, value)
+            for name, value in self.stats().items()
+        ]
@@ -0,0 +1,96 @@
+# journal.py
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger("journal")
+
+_STOP = object()
+
+
+class UpdateJournal:
+    """
+    Журнал входящих апдейтов: одна JSON-строка {"ts": ..., "update": {...}} на апдейт,
+    файл .jsonl.gz. Сжатие и запись — в отдельном потоке, event loop только кладёт в очередь.
+
+    Каждый запуск дописывает в файл новый gzip-member, read_journal читает их подряд.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="update-journal", daemon=True)
+        self._thread.start()
+        logger.info(f"Запись апдейтов в {self.path}")
+
+    def record(self, update: Update):
+        self._queue.put((time.time(), update.model_dump(mode="json", exclude_none=True, by_alias=True)))
+        self.recorded += 1
+
+    def stop(self):
+        """Дописывает очередь и закрывает файл"""
+        if not self._thread:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=15)
+        self._thread = None
+
+    def _run(self):
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                ts, update = item
+                f.write(json.dumps({"ts": ts, "update": update}, ensure_ascii=False) + "\n")
+                if self._queue.empty():
+                    # Очередь разобрана — сбрасываем буфер, чтобы при падении терялось минимум
+                    f.flush()
+
+
+class JournalMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: пишет апдейт в журнал до дедупликации, как он пришёл"""
+
+    def __init__(self, journal: UpdateJournal):
+        self.journal = journal
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.journal.record(event)
+        return await handler(event, data)
+
+
+def read_journal(path: str) -> Iterator[tuple[float, dict]]:
+    """(ts, update dict) в порядке записи"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # Оборванная строка после аварийной остановки
+                    logger.warning("Пропущена повреждённая строка журнала")
+                    continue
+                yield item["ts"], item["update"]
+        except EOFError:
+            logger.warning("Журнал обрывается (бот был остановлен аварийно) — читаем до места обрыва")
@@ -9,40 +9,110 @@ sys.path.insert(0, project_root)
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 import config
 import db
+import deletions
+import metrics
+import outbound
+import sharding
+import webhook
+from usernames import resolver
+from utils import setup_logging
+from journal import UpdateJournal, JournalMiddleware
+from fsm_storage import BoundedMemoryStorage, PostgresStorage, FSMFlushMiddleware
+from middlewares import UpdateDeduplicator, UsernameObserver
 from handlers import group
+from handlers import export
+from handlers import roster
 from handlers import registration
 from handlers import reg_mode
+from handlers import admin_logger
 
-# Настройка логов
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-7s | %(name)s | %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Настройка логов: JSON-строки, запись в отдельном потоке
+setup_logging(logging.INFO)
 logger = logging.getLogger("main")
 
 
-async def main():
-    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=MemoryStorage())
+def create_bot() -> Bot:
+    session = None
+    if config.TELEGRAM_API_URL:
+        # Локальный Bot API сервер или фейк для нагрузочных прогонов
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+    bot = Bot(token=config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(metrics.BotApiMetricsMiddleware())
+    return bot
+
+
+def create_storage():
+    if config.FSM_STORAGE == "postgres":
+        return PostgresStorage()
+    return BoundedMemoryStorage()
+
+
+def create_dispatcher(journal: UpdateJournal | None = None) -> Dispatcher:
+    storage = create_storage()
+    # Очереди пользователей — до всех middleware, в порядке прихода апдейтов (sharding.py)
+    dispatcher = sharding.OrderedDispatcher if config.DISPATCH_ORDERED else Dispatcher
+    dp = dispatcher(storage=storage)
+    if journal:
+        # Первым — чтобы в журнал попадало всё, включая повторы
+        dp.update.outer_middleware(JournalMiddleware(journal))
+    dp.update.outer_middleware(UpdateDeduplicator())
+    dp.update.outer_middleware(UsernameObserver())
+    if isinstance(storage, PostgresStorage):
+        dp.update.outer_middleware(FSMFlushMiddleware(storage))
+
+    handler_metrics = metrics.HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    dp.chat_member.middleware(handler_metrics)
 
     # Подключаем роутеры
     dp.include_router(group.router)
+    dp.include_router(export.router)
+    dp.include_router(roster.router)
     dp.include_router(registration.router)
     dp.include_router(reg_mode.router)
+    return dp
+
+
+async def main():
+    bot = create_bot()
+    journal = UpdateJournal(config.UPDATE_JOURNAL) if config.UPDATE_JOURNAL else None
+    dp = create_dispatcher(journal)
+    metrics_runner = None
 
     try:
         # Инициализация пула БД
         await db.init_pool()
         logger.info("✅ Подключение к базе данных успешно")
+        await db.load_bot_admins()
+        await resolver.setup()
+        await roster.setup()
+        if isinstance(dp.storage, PostgresStorage):
+            await dp.storage.setup()
+        admin_logger.start()
+        await deletions.scheduler.start(bot)
+        if journal:
+            journal.start()
         logging.getLogger("aiogram").setLevel(logging.WARNING)
+        if config.METRICS_PORT:
+            metrics_runner = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
 
-        logger.info("🚀 Бот запускается...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        logger.info(f"🚀 Бот запускается... (mode={config.BOT_MODE})")
+        if config.BOT_MODE == "webhook":
+            await webhook.run_webhook(dp, bot)
+        else:
+            # getUpdates не работает, пока висит webhook
+            await bot.delete_webhook()
+            await dp.start_polling(
+                bot,
+                allowed_updates=dp.resolve_used_update_types(),
+                tasks_concurrency_limit=config.UPDATES_CONCURRENCY,
+            )
 
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки (Ctrl+C)")
@@ -52,7 +122,18 @@ async def main():
 
     finally:
         logger.info("Завершение работы...")
+        if journal:
+            journal.stop()
+        await sharding.shards.stop()
+        await group.join_storm.stop()
+        await deletions.scheduler.stop()
+        await deletions.coalescer.stop()
+        await outbound.scheduler.stop()
+        await admin_logger.stop()
+        await dp.storage.close()
         await db.close_pool()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
         logger.info("Бот остановлен полностью")
 
@@ -0,0 +1,235 @@
+# metrics.py
+import bisect
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger("metrics")
+
+# Минимальная реализация Prometheus text format без внешних зависимостей.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list["_Metric"] = []
+_collectors: list[Callable[[], Iterable[tuple[str, str, dict, float]]]] = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        # key -> [counts по бакетам..., +Inf], sum
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+    def snapshot(self) -> dict[tuple, tuple[list[int], float]]:
+        return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+
+def register_collector(callback: Callable[[], Iterable[tuple[str, str, dict, float]]]):
+    """callback() -> [(name, help, labels, value)] — gauge, который считается в момент scrape"""
+    _collectors.append(callback)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    seen = set()
+    for collector in _collectors:
+        try:
+            samples = list(collector())
+        except Exception as e:
+            logger.warning(f"Коллектор метрик упал: {e}")
+            continue
+        for name, documentation, labels, value in samples:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ====================== Метрики бота ======================
+handler_latency = Histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера", ("handler",)
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("handler",)
+)
+db_acquire_wait = Histogram(
+    "bot_db_pool_acquire_wait_seconds", "Ожидание соединения из пула"
+)
+db_query_duration = Histogram(
+    "bot_db_query_duration_seconds", "Время выполнения запроса", ("statement",)
+)
+db_query_errors = Counter(
+    "bot_db_query_errors_total", "Ошибки запросов", ("statement",)
+)
+api_latency = Histogram(
+    "bot_api_request_duration_seconds", "Время вызова Bot API", ("method",)
+)
+api_errors = Counter(
+    "bot_api_request_errors_total", "Ошибки вызовов Bot API", ("method", "error")
+)
+
+_WS = re.compile(r"\s+")
+
+
+def statement_label(query: str) -> str:
+    """Короткая метка запроса: первые 100 символов без лишних пробелов"""
+    return _WS.sub(" ", query).strip()[:100]
+
+
+def on_query(record):
+    """Колбэк для asyncpg Connection.add_query_logger"""
+    label = statement_label(record.query)
+    db_query_duration.observe(record.elapsed, statement=label)
+    if record.exception is not None:
+        db_query_errors.inc(statement=label)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: латентность конкретного хендлера (по имени функции)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, handler=name)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: латентность и ошибки по методам Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - start, method=name)
+
+
+# ====================== HTTP ======================
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,59 @@
+# middlewares.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+import config
+from cache import TTLCache
+from usernames import resolver
+from utils import log_action
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """
+    Outer-middleware на dp.update: пропускает апдейт с уже виденным update_id.
+    Telegram повторяет webhook-запрос, если не дождался ответа, и без этого
+    вход в группу или шаг регистрации обрабатывался бы дважды.
+    """
+
+    def __init__(self, maxsize: int = config.UPDATE_DEDUP_SIZE, ttl: float = config.UPDATE_DEDUP_TTL):
+        self.seen = TTLCache(maxsize, ttl)
+        self.duplicates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if event.update_id in self.seen:
+            self.duplicates += 1
+            log_action("Повторный апдейт пропущен", handler="dedup", extra=f"update_id={event.update_id}")
+            return None
+        self.seen.set(event.update_id, True)
+        return await handler(event, data)
+
+
+class UsernameObserver(BaseMiddleware):
+    """Outer-middleware на dp.update: кормит usernames.resolver всеми увиденными пользователями"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = event.message or event.edited_message
+        if message:
+            resolver.observe(message.from_user)
+            if message.reply_to_message:
+                resolver.observe(message.reply_to_message.from_user)
+            for member in message.new_chat_members or ():
+                resolver.observe(member)
+        elif event.chat_member:
+            resolver.observe(event.chat_member.from_user)
+            resolver.observe(event.chat_member.new_chat_member.user)
+        elif event.callback_query:
+            resolver.observe(event.callback_query.from_user)
+        return await handler(event, data)
@@ -0,0 +1,312 @@
+# outbound.py
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import config
+import metrics
+
+logger = logging.getLogger("outbound")
+
+# Классы приоритета: меньше — раньше
+PRIORITY_MODERATION = 0  # restrict / ban / delete
+PRIORITY_WARNING = 1     # предупреждения reg_mode
+PRIORITY_INFO = 2        # приветствия, временные ответы админам
+
+MAX_RETRIES = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # токенов в секунду
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = 0.0
+        self.blocked_until = 0.0  # после RetryAfter
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 — можно сейчас)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "chat_id", "factory", "future", "coalesce_key", "attempts", "chat_limited")
+
+    def __init__(self, factory, chat_id, priority, coalesce_key, future):
+        self.factory = factory
+        self.chat_id = chat_id
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.attempts = 0
+        # Лимит 20 сообщений/мин действует на отправку в группы, модерацию не тормозим
+        self.chat_limited = chat_id is not None and chat_id < 0 and priority != PRIORITY_MODERATION
+
+
+def _consume_exception(future: asyncio.Future):
+    # Не все вызывающие ждут результат — не даём asyncio ругаться на потерянные ошибки
+    if not future.cancelled() and future.exception():
+        logger.warning(f"Запрос к Bot API не выполнен: {future.exception()}")
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future):
+    """Переносит результат source в target (схлопнутые вызовы)"""
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class OutboundScheduler:
+    """
+    Единая очередь исходящих вызовов Bot API.
+
+    - глобальный token bucket (OUTBOUND_GLOBAL_RATE в сек) и по одному на группу
+      (OUTBOUND_CHAT_RATE в минуту, только для отправки сообщений);
+    - приоритеты: модерация обгоняет предупреждения и приветствия;
+    - RetryAfter не теряет вызов — он возвращается в очередь после паузы
+      (группы с лимитом сообщений — только её, иначе всей очереди);
+    - вызовы с одинаковым coalesce_key, ещё не ушедшие в API, схлопываются в один.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = config.OUTBOUND_GLOBAL_RATE,
+        chat_rate_per_min: float = config.OUTBOUND_CHAT_RATE,
+        concurrency: int = config.OUTBOUND_CONCURRENCY,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate_per_min = chat_rate_per_min
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.concurrency = concurrency
+
+        self._seq = itertools.count()
+        self._ready: list[tuple[int, int, _Job]] = []
+        self._delayed: list[tuple[float, int, _Job]] = []
+        self._pending: dict[Hashable, _Job] = {}
+        # coalesce_key -> самый новый вызов (в очереди, в полёте или уже выполненный,
+        # пока живы более старые с тем же ключом) и сколько их живо
+        self._latest: dict[Hashable, _Job] = {}
+        self._live: dict[Hashable, int] = {}
+        self._wakeup = asyncio.Event()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    # ---------- API ----------
+    def submit(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        *,
+        chat_id: int | None = None,
+        priority: int = PRIORITY_INFO,
+        coalesce_key: Hashable | None = None,
+    ) -> asyncio.Future:
+        """
+        Ставит вызов в очередь. factory — функция без аргументов, возвращающая корутину,
+        например lambda: bot.send_message(...). Результат можно дождаться через await.
+        """
+        self.start()
+        if coalesce_key is not None:
+            job = self._pending.get(coalesce_key)
+            if job:
+                # Ещё не отправлено — отправим только самую свежую версию
+                job.factory = factory
+                self.coalesced += 1
+                return job.future
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        job = _Job(factory, chat_id, priority, coalesce_key, future)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = job
+            self._latest[coalesce_key] = job
+            self._live[coalesce_key] = self._live.get(coalesce_key, 0) + 1
+        self._push_ready(job)
+        return future
+
+    def is_pending(self, coalesce_key: Hashable) -> bool:
+        """Вызов с таким coalesce_key ещё стоит в очереди (новый схлопнется с ним)"""
+        return coalesce_key in self._pending
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._ready) + len(self._delayed),
+            "in_flight": len(self._running),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+        }
+
+    def start(self):
+        if self._worker:
+            return
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """Дожидается очереди (не дольше timeout) и останавливает воркер"""
+        if not self._worker:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._ready or self._delayed or self._running) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        for _, _, job in self._ready + self._delayed:
+            job.future.cancel()
+        self._ready.clear()
+        self._delayed.clear()
+        self._pending.clear()
+        self._latest.clear()
+        self._live.clear()
+
+    # ---------- внутреннее ----------
+    def _push_ready(self, job: _Job):
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _push_delayed(self, job: _Job, at: float):
+        heapq.heappush(self._delayed, (at, next(self._seq), job))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self.chat_rate_per_min / 60
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, self.chat_rate_per_min)
+        return bucket
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, job = heapq.heappop(self._delayed)
+                self._push_ready(job)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            _, _, job = heapq.heappop(self._ready)
+            if job.chat_limited:
+                bucket = self._chat_bucket(job.chat_id)
+                chat_wait = bucket.wait_time(now)
+                if chat_wait > 0:
+                    # Группа упёрлась в лимит — не держим остальных
+                    self._push_delayed(job, now + chat_wait)
+                    continue
+                bucket.take()
+            self.global_bucket.take()
+
+            if job.coalesce_key is not None and self._pending.get(job.coalesce_key) is job:
+                del self._pending[job.coalesce_key]
+
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await job.factory()
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            if job.attempts > MAX_RETRIES:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                self._finish_key(job)
+                return
+            self.retried += 1
+            resume_at = loop.time() + e.retry_after
+            # Лимит группы — ждёт только она; иначе флуд-контроль на весь бот, ждут все
+            bucket = self._chat_bucket(job.chat_id) if job.chat_limited else self.global_bucket
+            bucket.blocked_until = max(bucket.blocked_until, resume_at)
+            if job.coalesce_key is not None:
+                newer = self._latest.get(job.coalesce_key)
+                if newer is not job:
+                    # Пока ждали, появилась свежая версия (в очереди или уже отправлена) —
+                    # старую не шлём, её вызывающие получат результат новой
+                    newer.future.add_done_callback(lambda f, old=job.future: _chain(f, old))
+                    self.coalesced += 1
+                    self._finish_key(job)
+                    logger.warning(f"RetryAfter {e.retry_after}s chat_id={job.chat_id}, вызов схлопнут с более новым")
+                    return
+                self._pending[job.coalesce_key] = job
+            logger.warning(f"RetryAfter {e.retry_after}s chat_id={job.chat_id}, вызов возвращён в очередь")
+            self._push_delayed(job, resume_at)
+        except Exception as e:
+            # Вызывающего могли отменить, пока запрос был в полёте
+            if not job.future.done():
+                job.future.set_exception(e)
+            self._finish_key(job)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+            self._finish_key(job)
+        finally:
+            self._semaphore.release()
+
+    def _finish_key(self, job: _Job):
+        key = job.coalesce_key
+        if key is None:
+            return
+        live = self._live.get(key, 0) - 1
+        if live > 0:
+            self._live[key] = live
+        else:
+            self._live.pop(key, None)
+            self._latest.pop(key, None)
+
+
+scheduler = OutboundScheduler()
+
+
+def _outbound_metrics():
+    return [
+        (f"bot_outbound_{name}", "Очередь исходящих вызовов Bot API", {}, value)
+        for name, value in scheduler.stats().items()
+    ]
+
+
+metrics.register_collector(_outbound_metrics)
@@ -0,0 +1,192 @@
+# pool_control.py
+import asyncio
+import collections
+import logging
+import math
+import time
+from typing import Optional
+
+import config
+
+logger = logging.getLogger("pool_control")
+
+
+class PoolSaturated(RuntimeError):
+    """Соединение не получено: очередь переполнена или вышел дедлайн"""
+
+
+class AdaptivePoolLimiter:
+    """
+    Ворота перед asyncpg-пулом: не больше limit соединений на руках одновременно.
+
+    asyncpg не умеет менять max_size на лету, поэтому пул создаётся с верхней
+    границей DB_POOL_MAX, а реальное число соединений задаёт limit: новые
+    открываются только под спрос, простаивающие закрывает сам пул
+    (max_inactive_connection_lifetime).
+
+    Раз в DB_POOL_ADJUST_INTERVAL контроллер смотрит на ожидание и загрузку за окно:
+    - ждали дольше DB_POOL_TARGET_WAIT (p95) при загрузке > 80% или были отказы —
+      лимит растёт в 1.5 раза;
+    - загрузка < 30% и никто не ждал — лимит уменьшается на одно соединение.
+
+    Ожидающие стоят в очереди FIFO не дольше дедлайна; если очередь длиннее
+    DB_POOL_MAX_WAITERS или дедлайн вышел — PoolSaturated (отказ вместо зависания).
+    """
+
+    def __init__(
+        self,
+        min_size: int = config.DB_POOL_MIN,
+        max_size: int = config.DB_POOL_MAX,
+        initial: int = config.DB_POOL_INITIAL,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.limit = max(min_size, min(initial, max_size))
+        self.in_use = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._task: Optional[asyncio.Task] = None
+
+        # Окно текущего интервала
+        self._waits: list[float] = []
+        self._busy_area = 0.0
+        self._last_change = time.monotonic()
+        self._window_start = self._last_change
+        self._window_shed = 0
+
+        self.shed = 0
+        self.decisions: collections.deque[dict] = collections.deque(maxlen=100)
+
+    # ---------- ворота ----------
+    async def acquire(self, timeout: float | None = None):
+        if self.in_use < self.limit and not self._waiters:
+            self._take()
+            return
+        if len(self._waiters) >= config.DB_POOL_MAX_WAITERS:
+            self._reject()
+            raise PoolSaturated(f"очередь к пулу переполнена ({len(self._waiters)})")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout or config.DB_ACQUIRE_DEADLINE)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Место выдали в момент истечения таймаута — возвращаем, иначе оно утечёт
+                self.release()
+            self._reject()
+            raise PoolSaturated(f"нет свободного соединения за {timeout or config.DB_ACQUIRE_DEADLINE} с")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже выдано, а вызывающего отменили — возвращаем
+                self.release()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+
+    def release(self):
+        self._account()
+        self.in_use -= 1
+        self._wake()
+
+    def observe_wait(self, seconds: float):
+        self._waits.append(seconds)
+
+    def _take(self):
+        self._account()
+        self.in_use += 1
+
+    def _reject(self):
+        self.shed += 1
+        self._window_shed += 1
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self._take()
+                future.set_result(None)
+
+    def _account(self):
+        now = time.monotonic()
+        self._busy_area += self.in_use * (now - self._last_change)
+        self._last_change = now
+
+    # ---------- контроллер ----------
+    def start(self):
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.DB_POOL_ADJUST_INTERVAL)
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.error(f"Ошибка контроллера пула: {e}")
+
+    def adjust(self) -> Optional[dict]:
+        """Один шаг контроллера по окну с прошлого вызова. Возвращает решение, если лимит менялся"""
+        self._account()
+        now = self._last_change
+        elapsed = max(now - self._window_start, 1e-9)
+        utilization = self._busy_area / elapsed / self.limit
+        waits = sorted(self._waits)
+        wait_p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        shed = self._window_shed
+        queued = len(self._waiters)
+
+        self._waits = []
+        self._busy_area = 0.0
+        self._window_start = now
+        self._window_shed = 0
+
+        old = self.limit
+        if shed or queued or (wait_p95 > config.DB_POOL_TARGET_WAIT and utilization > 0.8):
+            new = min(self.max_size, max(old + 1, math.ceil(old * 1.5)))
+            reason = f"ожидание p95={wait_p95 * 1000:.1f} мс, загрузка {utilization:.0%}, отказов {shed}, в очереди {queued}"
+        elif utilization < 0.3 and wait_p95 <= config.DB_POOL_TARGET_WAIT:
+            new = max(self.min_size, old - 1)
+            reason = f"загрузка {utilization:.0%}"
+        else:
+            return None
+        if new == old:
+            return None
+
+        self.limit = new
+        self._wake()
+        decision = {
+            "ts": time.time(),
+            "from": old,
+            "to": new,
+            "reason": reason,
+            "wait_p95": round(wait_p95, 4),
+            "utilization": round(utilization, 3),
+            "shed": shed,
+        }
+        self.decisions.append(decision)
+        logger.info(f"Лимит пула {old} → {new}: {reason}")
+        return decision
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "waiting": len(self._waiters),
+            "shed": self.shed,
+        }
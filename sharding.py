@@ -0,0 +1,164 @@
+# sharding.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import config
+import metrics
+
+logger = logging.getLogger("sharding")
+
+queue_wait = metrics.Histogram(
+    "bot_user_queue_wait_seconds", "Ожидание апдейта в очереди пользователя"
+)
+
+
+def shard_key(update: Update) -> Optional[int]:
+    """Пользователь апдейта, если его нет — чат"""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat else None
+
+
+class UserQueues:
+    """
+    Очередь на каждого пользователя: его апдейты выполняются строго по очереди.
+
+    Очередь и её воркер создаются при первом апдейте пользователя и исчезают,
+    когда он всё разобрал, — долгий /export держит только своего автора, а не
+    всех, кому не повезло попасть с ним в один шард. Одновременно выполняется
+    не больше concurrency апдейтов. Очередь пользователя ограничена queue_size:
+    переполненная — submit ждёт места (backpressure), апдейты не теряются.
+    """
+
+    def __init__(self, queue_size: int = config.DISPATCH_USER_QUEUE, concurrency: int = config.UPDATES_CONCURRENCY):
+        self.queue_size = queue_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: Dict[int, asyncio.Queue] = {}
+        # Апдейтов пользователя в очереди и в ожидании места; воркер выходит только при нуле
+        self._backlog: Dict[int, int] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._queued = 0
+        self._stopping = False
+        self.dispatched = 0
+        self.failed = 0
+
+    async def submit(self, key: int, update_id: int, run: Callable[[], Awaitable[Any]]):
+        """Ставит апдейт в очередь пользователя key; run() выполнит воркер"""
+        if self._stopping:
+            logger.warning(f"Очереди остановлены, апдейт {update_id} не принят")
+            return
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(self.queue_size)
+            self._backlog[key] = 0
+            self._workers[key] = asyncio.create_task(self._run(key, queue))
+        # Считаем до await put: пока мы ждём места, воркер не должен решить, что очередь разобрана
+        self._backlog[key] += 1
+        self._queued += 1
+        self._idle.clear()
+        await queue.put((update_id, run, asyncio.get_running_loop().time()))
+
+    async def join(self):
+        """Ждёт, пока разберутся все очереди"""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float = 10):
+        """Дожидается очередей (не дольше timeout) и останавливает воркеры"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очереди пользователей не разобраны за отведённое время")
+        self._stopping = True
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._queued:
+            logger.warning(f"При остановке не обработано апдейтов: {self._queued}")
+        self._queued = 0
+        self._idle.set()
+        self._stopping = False
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self._queues.values()] or [0]
+        return {
+            "users": len(self._queues),
+            "queued": self._queued,
+            "max_depth": max(depths),
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+        }
+
+    async def _run(self, key: int, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._backlog[key]:
+                update_id, run, enqueued = await queue.get()
+                try:
+                    queue_wait.observe(loop.time() - enqueued)
+                    async with self._semaphore:
+                        self.dispatched += 1
+                        await run()
+                except asyncio.CancelledError:
+                    if self._stopping:
+                        raise
+                    # Отменился сам хендлер — очередь продолжает работать
+                    self.failed += 1
+                    logger.warning(f"Обработка апдейта {update_id} отменена")
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except BaseException:
+                    # ErrorsMiddleware уже отработал внутри feed_update — сюда доходят необработанные
+                    self.failed += 1
+                    logger.exception(f"Ошибка обработки апдейта {update_id}")
+                finally:
+                    self._backlog[key] -= 1
+                    self._queued -= 1
+                    if not self._queued:
+                        self._idle.set()
+        finally:
+            del self._queues[key]
+            del self._backlog[key]
+            del self._workers[key]
+
+
+class OrderedDispatcher(Dispatcher):
+    """
+    Dispatcher, который раскладывает апдейты по очередям пользователей (UserQueues).
+
+    feed_update зовут и polling, и webhook — апдейт встаёт в очередь до всех
+    middleware, в порядке прихода. Поэтому FSMContextMiddleware читает состояние,
+    когда предыдущий апдейт пользователя уже обработан, а ошибки хендлеров, как
+    обычно, проходят через ErrorsMiddleware (dp.errors). Вызывающий ждёт только
+    постановки в очередь, а не обработки.
+    """
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        key = shard_key(update)
+        if key is None:
+            return await super().feed_update(bot, update, **kwargs)
+        feed = super().feed_update
+        await shards.submit(key, update.update_id, lambda: feed(bot, update, **kwargs))
+
+
+shards = UserQueues()
+
+
+def _shard_metrics():
+    stats = shards.stats()
+    return [
+        ("bot_user_queues", "Пользователей с непустой очередью", {}, stats["users"]),
+        ("bot_user_queue_updates", "Апдейтов в очередях пользователей", {}, stats["queued"]),
+    ]
+
+
+metrics.register_collector(_shard_metrics)
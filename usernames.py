@@ -0,0 +1,91 @@
+# usernames.py
+import asyncio
+import logging
+
+import config
+import db
+from cache import TTLCache
+
+logger = logging.getLogger("usernames")
+
+
+class UsernameResolver:
+    """
+    @username -> (telegram_id, username) без учёта регистра.
+
+    Карта пополняется из каждого апдейта (UsernameObserver в middlewares.py),
+    поэтому актуальнее, чем users.username. Промах — запрос в БД
+    по функциональному индексу lower(username).
+    """
+
+    def __init__(self, maxsize: int = config.USERNAME_CACHE_SIZE, ttl: float = config.USERNAME_CACHE_TTL):
+        self.by_name = TTLCache(maxsize, ttl)  # lower(username) -> (telegram_id, username)
+        self.by_id = TTLCache(maxsize, ttl)    # telegram_id -> lower(username)
+        self._index_task: asyncio.Task | None = None
+
+    async def setup(self):
+        # На большой users индекс строится минутами — не держим из-за него старт бота
+        if self._index_task is None:
+            self._index_task = asyncio.create_task(self._create_index())
+
+    async def _create_index(self):
+        try:
+            await db.ensure_index("users_username_lower_idx", "users (lower(username))")
+        except Exception as e:
+            logger.error(f"Не удалось создать индекс users_username_lower_idx: {e}")
+
+    def observe(self, user):
+        if not user or user.is_bot or not user.username:
+            return
+        key = user.username.lower()
+        old_key = self.by_id.get(user.id)
+        if old_key and old_key != key:
+            # Пользователь сменил username — старое имя больше не его
+            self.by_name.pop(old_key)
+        self.by_name.set(key, (user.id, user.username))
+        self.by_id.set(user.id, key)
+
+    def _remember(self, telegram_id: int, username: str):
+        self.by_name.set(username.lower(), (telegram_id, username))
+        self.by_id.set(telegram_id, username.lower())
+
+    async def resolve(self, username: str) -> tuple[int, str] | None:
+        username = username.lstrip("@")
+        hit = self.by_name.get(username.lower())
+        if hit:
+            return hit
+        row = await db.fetchrow_read("""
+            SELECT telegram_id, username FROM users
+            WHERE lower(username) = lower($1)
+            ORDER BY updated_at DESC NULLS LAST
+            LIMIT 1
+        """, username)
+        if not row:
+            return None
+        self._remember(row["telegram_id"], row["username"])
+        return row["telegram_id"], row["username"]
+
+    async def resolve_many(self, usernames: list[str]) -> dict[str, tuple[int, str]]:
+        """Несколько @username за один запрос. Ключ результата — lower(username)"""
+        result = {}
+        missing = []
+        for username in usernames:
+            key = username.lstrip("@").lower()
+            hit = self.by_name.get(key)
+            if hit:
+                result[key] = hit
+            elif key not in missing:
+                missing.append(key)
+        if missing:
+            rows = await db.fetch_read("""
+                SELECT DISTINCT ON (lower(username)) telegram_id, username FROM users
+                WHERE lower(username) = ANY($1::text[])
+                ORDER BY lower(username), updated_at DESC NULLS LAST
+            """, missing)
+            for row in rows:
+                self._remember(row["telegram_id"], row["username"])
+                result[row["username"].lower()] = (row["telegram_id"], row["username"])
+        return result
+
+
+resolver = UsernameResolver()
@@ -1,41 +1,137 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 from aiogram.fsm.context import FSMContext
 
+import config
+
+
+# ====================== Логирование ======================
+# Хендлеры только кладут LogRecord в очередь. Форматирование в JSON и запись
+# в stderr делает поток QueueListener, event loop на I/O не блокируется.
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        action = getattr(record, "action", None)
+        if action is not None:
+            data["action"] = action
+            user = getattr(record, "act_user", None)
+            if user:
+                data["user"] = _format_user(*user)
+                data["user_id"] = user[0]
+            for key, field in (("handler", "act_handler"), ("extra", "act_extra"), ("suppressed", "suppressed")):
+                value = getattr(record, field, None)
+                if value:
+                    data[key] = value
+        else:
+            data["message"] = record.getMessage()
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare() форматирует сообщение в вызывающем потоке — нам это не нужно
+        return record
+
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(JsonFormatter())
+_listener = QueueListener(_log_queue, _stream_handler, respect_handler_level=False)
+_listener.start()
+atexit.register(_listener.stop)
+queue_handler = _LazyQueueHandler(_log_queue)
+
+
+def setup_logging(level: int = logging.INFO):
+    """Переводит root-логгер на ту же очередь (вместо logging.basicConfig)"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(queue_handler)
+
+
 logger = logging.getLogger("bot_actions")
 logger.setLevel(logging.INFO)
 if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter("%(asctime)s | %(levelname)-7s | %(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    logger.addHandler(queue_handler)
     logger.propagate = False
 
 
+# ====================== Ограничение частоты событий ======================
+class _ActionRateLimiter:
+    """
+    Token bucket на каждое action из LOG_RATE_LIMITS (событий в секунду).
+    Отброшенные записи не теряются бесследно: их число уходит
+    в поле suppressed следующей пропущенной записи.
+    """
+
+    def __init__(self, limits: dict[str, float]):
+        self.limits = limits
+        self._state: dict[str, list] = {}  # action -> [tokens, updated, suppressed]
+
+    def check(self, action: str) -> int | None:
+        """None — запись отбросить, иначе сколько было отброшено перед ней"""
+        rate = self.limits.get(action)
+        if rate is None:
+            return 0
+        now = time.monotonic()
+        state = self._state.get(action)
+        if state is None:
+            state = self._state[action] = [max(rate, 1.0), now, 0]
+        burst = max(rate, 1.0)
+        state[0] = min(burst, state[0] + (now - state[1]) * rate)
+        state[1] = now
+        if state[0] < 1:
+            state[2] += 1
+            return None
+        state[0] -= 1
+        suppressed, state[2] = state[2], 0
+        return suppressed
+
+
+_rate_limiter = _ActionRateLimiter(config.LOG_RATE_LIMITS)
+
+
+def _format_user(user_id: int, username: str | None, first_name: str | None) -> str:
+    username = f"@{username}" if username else f"ID{user_id}"
+    return f"{first_name or 'Без имени'} ({username})"
+
+
 def get_user_info(user) -> str:
     if not user:
         return "SYSTEM"
-    username = f"@{user.username}" if user.username else f"ID{user.id}"
-    name = user.first_name or "Без имени"
-    return f"{name} ({username})"
+    return _format_user(user.id, user.username, user.first_name)
 
 
 def log_action(action: str, user=None, handler: str | None = None, extra: str | None = None, *, level="INFO"):
-    parts = [action]
-    if user:
-        parts.append(get_user_info(user))
-    if handler:
-        parts.append(handler)
-    if extra:
-        parts.append(extra)
-    message = " | ".join(parts)
-    level = level.upper()
-    if level == "WARNING":
-        logger.warning(message)
-    elif level == "ERROR":
-        logger.error(message)
-    else:
-        logger.info(message)
+    levelno = logging.getLevelName(level.upper())
+    if not isinstance(levelno, int):
+        levelno = logging.INFO
+    if not logger.isEnabledFor(levelno):
+        return
+    suppressed = _rate_limiter.check(action)
+    if suppressed is None:
+        return
+    # Строку собирает JsonFormatter в потоке логов — здесь только сырые поля
+    logger.log(levelno, action, extra={
+        "action": action,
+        "act_user": (user.id, user.username, user.first_name) if user else None,
+        "act_handler": handler,
+        "act_extra": extra,
+        "suppressed": suppressed,
+    })
 
 
 async def log_fsm(state: FSMContext, user, to_state: str | None, reason: str = ""):
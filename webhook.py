@@ -0,0 +1,87 @@
+# webhook.py
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import config
+
+logger = logging.getLogger("webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **kwargs):
+    """
+    Принимает апдейты через aiohttp-сервер и отдаёт их в тот же Dispatcher.
+    Ответ Telegram'у уходит сразу, обработка идёт в фоне —
+    не больше UPDATES_CONCURRENCY апдейтов одновременно.
+    """
+    semaphore = asyncio.Semaphore(config.UPDATES_CONCURRENCY)
+    tasks: set[asyncio.Task] = set()
+    workflow_data = {**dp.workflow_data, **kwargs}
+
+    async def process(update: Update):
+        async with semaphore:
+            try:
+                await dp.feed_update(bot, update, **kwargs)
+            except Exception:
+                logger.exception(f"Ошибка обработки апдейта {update.update_id}")
+
+    async def handle(request: web.Request) -> web.Response:
+        if config.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != config.WEBHOOK_SECRET:
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт: {e}")
+            return web.Response(status=400)
+        task = asyncio.create_task(process(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await site.start()
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(config.UPDATES_CONCURRENCY, 100),
+            )
+        logger.info(
+            f"Webhook слушает {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}, "
+            f"concurrency={config.UPDATES_CONCURRENCY}"
+        )
+        # Как start_polling: SIGTERM/SIGINT (docker stop, Ctrl+C) — штатная остановка,
+        # чтобы finally в main.py дописал логи, FSM, отложенные удаления и очередь Bot API
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows
+                pass
+        await stop.wait()
+        logger.info("Получен сигнал остановки, webhook завершается")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                asyncio.get_running_loop().remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        await runner.cleanup()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, **workflow_data)